@@ -50,11 +50,8 @@ function setup() {
         TF_VERSION=$INPUT_TF_VERSION
     fi
 
-    curl -Lo /usr/local/bin/terragrunt "https://github.com/gruntwork-io/terragrunt/releases/download/v${TG_VERSION}/terragrunt_linux_amd64"
-    chmod +x /usr/local/bin/terragrunt
-    curl -o /tmp/terraform_${TF_VERSION}_linux_amd64.zip https://releases.hashicorp.com/terraform/${TF_VERSION}/terraform_${TF_VERSION}_linux_amd64.zip
-    unzip /tmp/terraform_${TF_VERSION}_linux_amd64.zip -d /usr/local/bin/
-    chmod +x /usr/local/bin/terraform
+    # Verified executables are cached by version in JOB_TMP_DIR
+    install-toolchain "$TG_VERSION" "$TF_VERSION"
 
     end_group
 
@@ -84,7 +81,8 @@ function plan() {
     debug_log terragrunt run-all plan --terragrunt-download-dir $TG_CACHE_DIR -input=false -no-color -detailed-exitcode -lock-timeout=300s $PARALLEL_ARG -out=plan.out '$PLAN_ARGS'  # don't expand PLAN_ARGS
 
     # Get a list of all modules in the provided path
-    MODULE_PATHS=$(terragrunt output-module-groups --terragrunt-working-dir $INPUT_PATH|jq -r 'to_entries | .[].value[]')
+    terragrunt output-module-groups --terragrunt-working-dir $INPUT_PATH >"$STEP_TMP_DIR/module_groups.json"
+    MODULE_PATHS=$(jq -r 'to_entries | .[].value[]' "$STEP_TMP_DIR/module_groups.json")
     export MODULE_PATHS
 
     start_group "List of modules found in the provided input path"
@@ -96,24 +94,31 @@ function plan() {
     set +e
     # shellcheck disable=SC2086
     start_group "Generating plan"
-    (
-        (cd "$INPUT_PATH" && terragrunt run-all plan --terragrunt-download-dir $TG_CACHE_DIR -input=false -no-color -detailed-exitcode -lock-timeout=300s $PARALLEL_ARG -out=plan.out $PLAN_ARGS) \
-            2>"$STEP_TMP_DIR/terraform_plan.stderr" \
-            | $TFMASK
-        wait
-    )
+    if [[ "${INPUT_STRATEGY:-}" == "groups" ]]; then
+        terragrunt-plan-groups $PLAN_ARGS
+        PLAN_EXIT_CODE=$?
+    else
+        (
+            (cd "$INPUT_PATH" && terragrunt run-all plan --terragrunt-download-dir $TG_CACHE_DIR -input=false -no-color -detailed-exitcode -lock-timeout=300s $PARALLEL_ARG -out=plan.out $PLAN_ARGS) \
+                2>"$STEP_TMP_DIR/terraform_plan.stderr" \
+                | $TFMASK
+            wait
+        )
+    fi
     end_group
 
     # Generate text file for each plan
     start_group "Generating plan it text format"
-    # shellcheck disable=SC2034
-    for i in $MODULE_PATHS; do
-        plan_name=${i//\//___}
-        terragrunt show plan.out --terragrunt-working-dir $i -no-color --terragrunt-download-dir $TG_CACHE_DIR 2>"$STEP_TMP_DIR/terraform_show_plan.stderr" \
-            |tee $PLAN_OUT_DIR/$plan_name
-    done
+    # shellcheck disable=SC2086
+    terragrunt-show-all $MODULE_PATHS
     end_group
     set -e
+
+    if [[ -f "$PLAN_OUT_DIR/index.json" ]]; then
+        mkdir -p "$WORKSPACE_TMP_DIR"
+        cp "$PLAN_OUT_DIR/index.json" "$WORKSPACE_TMP_DIR/plan_summary.json"
+        set_output plan_summary_path "$WORKSPACE_TMP_DIR/plan_summary.json"
+    fi
 }
 
 function apply() {
@@ -121,12 +126,28 @@ function apply() {
     # shellcheck disable=SC2086
     debug_log terragrunt run-all apply --terragrunt-download-dir $TG_CACHE_DIR -input=false -no-color -auto-approve -lock-timeout=300s $PARALLEL_ARG '$PLAN_ARGS' plan.out
 
+    # Whether each module has changes, from the plan summary if there is one
+    declare -A plan_changes=()
+    if [[ -f "$PLAN_OUT_DIR/index.json" ]]; then
+        while read -r plan_name changes; do
+            plan_changes[$plan_name]=$changes
+        done < <(jq -r '.modules[] | "\(.plan_name) \(.changes)"' "$PLAN_OUT_DIR/index.json")
+    fi
+
     set +e
     start_group "Applying plan sequentially"
     (
         for i in $MODULE_PATHS; do
             plan_name=${i//\//___}
-            if grep -q "No changes." $PLAN_OUT_DIR/$plan_name; then
+            if [[ -v "plan_changes[$plan_name]" ]]; then
+                changes=${plan_changes[$plan_name]}
+            elif grep -q "No changes." "$PLAN_OUT_DIR/$plan_name"; then
+                changes=false
+            else
+                changes=true
+            fi
+
+            if [[ "$changes" == "false" ]]; then
                 echo "There is no changes in the module ${INPUT_PATH}${i#*${INPUT_PATH#./}}, skiping plan apply for it"
                 continue
             else
@@ -161,6 +182,20 @@ function apply_all() {
     set -e
 }
 
+function apply_groups() {
+
+    # shellcheck disable=SC2086
+    debug_log terragrunt-apply-groups '$PLAN_ARGS'
+
+    set +e
+    start_group "Applying plan by dependency group"
+    # shellcheck disable=SC2086
+    terragrunt-apply-groups $PLAN_ARGS
+    APPLY_EXIT_CODE=$?
+    end_group
+    set -e
+}
+
 function job_markdown_ref() {
     echo "[${GITHUB_WORKFLOW} #${GITHUB_RUN_NUMBER}](${GITHUB_SERVER_URL}/${GITHUB_REPOSITORY}/actions/runs/${GITHUB_RUN_ID})"
 }
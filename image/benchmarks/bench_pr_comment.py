@@ -0,0 +1,236 @@
+"""
+Benchmarks for the github_pr_comment hot paths
+
+Usage:
+    python benchmarks/bench_pr_comment.py [--quick] [--filter SUBSTRING] [--output FILE]
+                                          [--baseline FILE] [--save-baseline] [--tolerance FRACTION]
+
+Run from the image directory. Each benchmark is run several times and the fastest wall time is reported.
+Peak memory is measured with tracemalloc in a separate run, as tracing slows the code down.
+
+Results are compared against the stored baseline (benchmarks/baseline.json by default), and the exit code
+is 1 if any benchmark is slower or uses more memory than the baseline by more than the tolerance.
+Use --save-baseline to replace the baseline with the results of this run.
+Baselines are only comparable when recorded on the same machine.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, List, NamedTuple
+
+BENCHMARK_DIR = Path(__file__).parent
+sys.path.insert(0, str(BENCHMARK_DIR.parent / 'src'))
+sys.path.insert(0, str(BENCHMARK_DIR))
+
+from plan_generator import generate_plan, generate_sections, write_plan_dir
+
+KB = 1024
+MB = 1024 * KB
+
+
+class Benchmark(NamedTuple):
+    name: str
+    function: Callable[[], object]
+    repeat: int = 5
+
+
+class Result(NamedTuple):
+    name: str
+    seconds: float
+    peak_bytes: int
+
+
+def _import_main(tmp_dir: Path):
+    """Import github_pr_comment.__main__ with its caches in a temporary directory"""
+
+    os.environ.setdefault('TERRAFORM_ACTIONS_GITHUB_TOKEN', 'benchmark')
+    os.environ['JOB_TMP_DIR'] = str(tmp_dir / 'job')
+    os.environ['STEP_TMP_DIR'] = str(tmp_dir / 'step')
+
+    import github_pr_comment.__main__ as main
+    return main
+
+
+def benchmarks(tmp_dir: Path, quick: bool) -> List[Benchmark]:
+    """
+    Set up the benchmarks
+
+    If quick is True the benchmarks with the most modules and the largest plans are skipped.
+    """
+
+    main = _import_main(tmp_dir)
+
+    from github_pr_comment.comment import TerraformComment, _from_api_payload, _to_api_payloads
+    from github_pr_comment.hash import plan_file_hash, plan_hash
+    from github_pr_comment.plan_index import ingest_plans, load_plans, write_index
+    from github_actions.cache import ActionsCache
+
+    issue_url = 'https://api.github.com/repos/wayofdev/gh-actions-terragrunt/issues/1'
+    comment_url = 'https://api.github.com/repos/wayofdev/gh-actions-terragrunt/issues/comments/1'
+
+    result = []
+
+    def plan_dir_benchmarks(modules: int, plan_size: int) -> None:
+        label = f'{modules}x{plan_size // KB}KB'
+        folder = tmp_dir / f'plan-{label}'
+        write_plan_dir(folder, modules, plan_size)
+        repeat = 5 if modules * plan_size < 10 * MB else 2
+
+        def ingest():
+            return list(ingest_plans(str(folder), issue_url, 'text', tmp_dir))
+
+        ingested = ingest()
+        plans = [plan for plan, _ in ingested]
+        write_index(ActionsCache(tmp_dir / f'index-{label}'), issue_url, 'text', plans)
+
+        def index():
+            # A new ActionsCache each time, so the index is read from disk
+            return load_plans(str(folder), issue_url, 'text', tmp_dir, ActionsCache(tmp_dir / f'index-{label}'))
+
+        result.append(Benchmark(f'ingest_plans[{label}]', ingest, repeat))
+        result.append(Benchmark(f'create_sections[{label}]', lambda: main.create_sections(ingested), repeat))
+        result.append(Benchmark(f'create_plan_hashes[{label}]', lambda: main.create_plan_hashes(plans), repeat))
+        result.append(Benchmark(f'load_plans[{label}]', index, repeat))
+
+        comment = TerraformComment(
+            issue_url=issue_url,
+            comment_url=comment_url,
+            headers={'plan_hashes': main.create_plan_hashes(plans)},
+            description='Plan for benchmarking',
+            sections=[],
+            status='Plan generated.'
+        )
+        result.append(Benchmark(f'is_approved[{label}]', lambda: main.is_approved(plans, comment), repeat))
+
+    plan_dir_benchmarks(1, 1 * KB)
+    plan_dir_benchmarks(100, 1 * KB)
+    plan_dir_benchmarks(1, 1 * MB)
+    if not quick:
+        plan_dir_benchmarks(2000, 1 * KB)
+        plan_dir_benchmarks(1, 50 * MB)
+
+    for size in [1 * KB, 1 * MB] + ([] if quick else [50 * MB]):
+        plan = generate_plan(size)
+        result.append(Benchmark(f'plan_hash[{size // KB}KB]', lambda plan=plan: plan_hash(plan, issue_url), 5 if size < 10 * MB else 2))
+
+        plan_path = tmp_dir / f'plan-{size // KB}KB'
+        plan_path.write_text(plan)
+        result.append(Benchmark(f'plan_file_hash[{size // KB}KB]', lambda path=plan_path: plan_file_hash(path, issue_url), 5 if size < 10 * MB else 2))
+
+    def comment(sections: List[dict]) -> TerraformComment:
+        return TerraformComment(
+            issue_url=issue_url,
+            comment_url=comment_url,
+            headers={'workspace': 'default', 'plan_hashes': [{'plan_name': s['summary'].split(':')[0].replace('/', '___'), 'plan_hash': '0' * 64} for s in sections]},
+            description='Plan for benchmarking',
+            sections=sections,
+            status='Plan generated.'
+        )
+
+    # Bodies just under the GitHub comment size limit, as one large section and as many small sections
+    near_limit = {
+        'near_limit_1_section': comment(generate_sections(1, 60 * KB)),
+        'near_limit_40_sections': comment(generate_sections(40, 1200)),
+    }
+    if not quick:
+        near_limit['sharded_2000_sections'] = comment(generate_sections(2000, 1 * KB))
+
+    for label, terraform_comment in near_limit.items():
+        result.append(Benchmark(f'_to_api_payloads[{label}]', lambda c=terraform_comment: _to_api_payloads(c)))
+
+        _, body = _to_api_payloads(terraform_comment)[0]
+        payload = {'body': body, 'url': comment_url, 'issue_url': issue_url}
+        result.append(Benchmark(f'_from_api_payload[{label}]', lambda p=payload: _from_api_payload(p)))
+
+    return result
+
+
+def measure(benchmark: Benchmark) -> Result:
+    times = []
+    for _ in range(benchmark.repeat):
+        start = time.perf_counter()
+        benchmark.function()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        benchmark.function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return Result(benchmark.name, min(times), peak)
+
+
+def compare(results: List[Result], baseline: dict, tolerance: float) -> List[str]:
+    """Return a description of each result that is worse than the baseline"""
+
+    regressions = []
+
+    for result in results:
+        if result.name not in baseline:
+            continue
+
+        expected = baseline[result.name]
+        if result.seconds > expected['seconds'] * (1 + tolerance):
+            regressions.append(f'{result.name}: {result.seconds:.4f}s, baseline {expected["seconds"]:.4f}s')
+        if result.peak_bytes > expected['peak_bytes'] * (1 + tolerance):
+            regressions.append(f'{result.name}: peak {result.peak_bytes} bytes, baseline {expected["peak_bytes"]} bytes')
+
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Benchmark the github_pr_comment hot paths')
+    parser.add_argument('--quick', action='store_true', help='Skip the largest benchmarks')
+    parser.add_argument('--filter', default='', help='Only run benchmarks with names containing this string')
+    parser.add_argument('--output', type=Path, help='Write the results to this file as JSON')
+    parser.add_argument('--baseline', type=Path, default=BENCHMARK_DIR / 'baseline.json', help='The baseline to compare against')
+    parser.add_argument('--save-baseline', action='store_true', help='Save the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='The allowed fractional increase over the baseline')
+    args = parser.parse_args()
+
+    # Debug messages from the code being benchmarked are discarded
+    with tempfile.TemporaryDirectory() as tmp_dir, contextlib.redirect_stderr(open(os.devnull, 'w')):
+        results = []
+
+        for benchmark in benchmarks(Path(tmp_dir), args.quick):
+            if args.filter not in benchmark.name:
+                continue
+
+            result = measure(benchmark)
+            results.append(result)
+            print(f'{result.name:<50} {result.seconds * 1000:>12.3f} ms {result.peak_bytes / MB:>10.2f} MB', flush=True)
+
+    serialized = {result.name: {'seconds': result.seconds, 'peak_bytes': result.peak_bytes} for result in results}
+
+    if args.output:
+        args.output.write_text(json.dumps(serialized, indent=2) + '\n')
+
+    if args.save_baseline:
+        baseline = json.loads(args.baseline.read_text()) if args.baseline.exists() else {}
+        baseline.update(serialized)
+        args.baseline.write_text(json.dumps(baseline, indent=2, sort_keys=True) + '\n')
+        print(f'Saved baseline to {args.baseline}')
+        return 0
+
+    if not args.baseline.exists():
+        print(f'No baseline at {args.baseline}')
+        return 0
+
+    regressions = compare(results, json.loads(args.baseline.read_text()), args.tolerance)
+    for regression in regressions:
+        print(f'Regression: {regression}')
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
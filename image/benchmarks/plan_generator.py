@@ -0,0 +1,125 @@
+"""
+Generate synthetic terragrunt plans and PR comments for benchmarking
+
+The plans look like the output of `terraform show` for a saved plan: resource changes with unchanged
+attributes hidden, a moved resource, output changes, a warning and a summary line.
+Generation is deterministic for a given seed, so benchmark runs are comparable.
+"""
+
+import os
+import random
+from pathlib import Path
+from typing import List
+
+_RESOURCE_TYPES = ['aws_instance', 'aws_s3_bucket', 'aws_iam_role', 'aws_security_group', 'random_string', 'null_resource']
+
+_WARNING = '''
+Warning: Argument is deprecated
+
+  with aws_s3_bucket.example,
+  on main.tf line 12, in resource "aws_s3_bucket" "example":
+  12:   acl = "private"
+
+Use the aws_s3_bucket_acl resource instead
+'''
+
+
+def _resource_change(rng: random.Random, index: int) -> str:
+    resource_type = rng.choice(_RESOURCE_TYPES)
+    name = f'{resource_type}.resource_{index}'
+
+    lines = [
+        f'  # {name} will be updated in-place',
+        f'  ~ resource "{resource_type}" "resource_{index}" {{',
+        f'        id   = "{rng.getrandbits(64):016x}"',
+    ]
+
+    for attribute in range(rng.randint(1, 8)):
+        lines.append(f'      ~ attribute_{attribute} = "{rng.getrandbits(32):08x}" -> "{rng.getrandbits(32):08x}"')
+
+    lines += [
+        f'        # ({rng.randint(1, 30)} unchanged attributes hidden)',
+        '',
+        '      ~ tags = {',
+        f'          ~ "Name" = "resource-{index}" -> "resource-{index}-updated"',
+        '            # (2 unchanged elements hidden)',
+        '        }',
+        '',
+        f'        # ({rng.randint(1, 5)} unchanged blocks hidden)',
+        '    }',
+        '',
+    ]
+
+    return '\n'.join(lines) + '\n'
+
+
+def generate_plan(size: int, seed: int = 0) -> str:
+    """
+    Generate the text of a plan that is approximately size bytes
+    """
+
+    rng = random.Random(seed)
+
+    header = '''
+Terraform used the selected providers to generate the following execution
+plan. Resource actions are indicated with the following symbols:
+  ~ update in-place
+
+Terraform will perform the following actions:
+
+'''
+
+    footer = '''
+Changes to Outputs:
+  ~ instance_count = 1 -> 2
+'''
+
+    changes = []
+    length = len(header) + len(footer) + len(_WARNING) + 100
+    count = 0
+
+    while length < size or count == 0:
+        change = _resource_change(rng, count)
+        changes.append(change)
+        length += len(change)
+        count += 1
+
+    changes.append('  # aws_instance.old has moved to aws_instance.new\n')
+
+    return ''.join([header, *changes, f'\nPlan: 0 to add, {count} to change, 0 to destroy.\n', footer, _WARNING])
+
+
+def module_path(index: int) -> str:
+    return f'environments/prod/region-{index % 4}/module_{index}'
+
+
+def write_plan_dir(path: Path, modules: int, plan_size: int, seed: int = 0) -> List[str]:
+    """
+    Write the plans for a number of modules to a directory, named the same way as the action names them in PLAN_OUT_DIR
+
+    :returns: The plan file names
+    """
+
+    os.makedirs(path, exist_ok=True)
+
+    names = []
+    for index in range(modules):
+        name = module_path(index).replace('/', '___')
+        Path(path, name).write_text(generate_plan(plan_size, seed + index))
+        names.append(name)
+
+    return names
+
+
+def generate_sections(modules: int, plan_size: int, seed: int = 0) -> List[dict]:
+    """
+    Generate PR comment sections, as created by create_sections
+    """
+
+    sections = []
+    for index in range(modules):
+        plan = generate_plan(plan_size, seed + index)
+        summary = next(line for line in plan.splitlines() if line.startswith('Plan:'))
+        sections.append({'summary': f'{module_path(index)}: {summary}', 'body': plan})
+
+    return sections
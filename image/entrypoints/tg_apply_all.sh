@@ -36,6 +36,8 @@ if [[ "$INPUT_AUTO_APPROVE" == "true" ]]; then
     echo "Automatically approving plan"
     if [[ "$INPUT_STRATEGY" == "parallel" ]]; then
         apply_all
+    elif [[ "$INPUT_STRATEGY" == "groups" ]]; then
+        apply_groups
     else
         apply
     fi
@@ -56,6 +58,8 @@ else
     if github_pr_comment approved; then
         if [[ "$INPUT_STRATEGY" == "parallel" ]]; then
             apply_all
+        elif [[ "$INPUT_STRATEGY" == "groups" ]]; then
+            apply_groups
         else
             apply
         fi
@@ -78,13 +82,10 @@ if [[ "$INPUT_STRATEGY" == "parallel" ]]; then
     if lock-info "$STEP_TMP_DIR/terraform_apply.stderr"; then
         update_status ":x: Error applying plan in $(job_markdown_ref) (State is locked)"
         exit 1
-    else
-        for code in $(tac $STEP_TMP_DIR/terraform_apply.stderr | awk '/^[[:space:]]*\*/{flag=1; print} flag && /^[[:space:]]*time=/{exit}' | awk '{print $5}'); do
-            if [[ $code -eq 1 ]]; then
-                update_status ":x: Error applying plan in $(job_markdown_ref)"
-                exit 1
-            fi
-        done
+    elif ! terragrunt-run-all-status "$STEP_TMP_DIR/terraform_apply.stderr" >"$STEP_TMP_DIR/terraform_apply_status.json"; then
+        debug_file "$STEP_TMP_DIR/terraform_apply_status.json"
+        update_status ":x: Error applying plan in $(job_markdown_ref)"
+        exit 1
     fi
 
 else
@@ -117,20 +118,24 @@ else
         fi
     done
 
-    # check if there are errors in terraform_apply.stderr
-    for file in $STEP_TMP_DIR/terraform_apply_error/*; do
-        if lock-info "$file"; then
-            update_status ":x: Error applying plan in $(job_markdown_ref) (State is locked)"
-            exit 1
-        else
-            for code in $(tac $file | awk '/^[[:space:]]*\*/{flag=1; print} flag && /^[[:space:]]*time=/{exit}' | awk '{print $5}'); do
-                if [[ $code -eq 1 ]]; then
-                    update_status ":x: Error applying plan in $(job_markdown_ref)"
-                    exit 1
-                fi
-            done
-        fi
-    done
+    # check if the state of any module is locked
+    if lock-info "$STEP_TMP_DIR/terraform_apply_error"; then
+        update_status ":x: Error applying plan in $(job_markdown_ref) (State is locked)"
+        exit 1
+    fi
+
+    # check if there are errors in terraform_apply_error
+    if ! terragrunt-run-all-status "$STEP_TMP_DIR/terraform_apply_error" >"$STEP_TMP_DIR/terraform_apply_status.json"; then
+        debug_file "$STEP_TMP_DIR/terraform_apply_status.json"
+        update_status ":x: Error applying plan in $(job_markdown_ref)"
+        exit 1
+    fi
+
+    # Modules are applied individually, so failures are only known from the exit code
+    if [[ "$INPUT_STRATEGY" == "groups" && "$APPLY_EXIT_CODE" -ne 0 ]]; then
+        update_status ":x: Error applying plan in $(job_markdown_ref)"
+        exit 1
+    fi
 fi
 
 update_status ":white_check_mark: Plan applied in $(job_markdown_ref)"
@@ -36,13 +36,18 @@ if [[ "$GITHUB_EVENT_NAME" == "pull_request" || "$GITHUB_EVENT_NAME" == "issue_c
             exit 1
         fi
 
+        # Modules are planned individually, so failures are only known from the exit code
+        if [[ "${INPUT_STRATEGY:-}" == "groups" && "$PLAN_EXIT_CODE" -ne 0 ]]; then
+            STATUS=":x: Failed to generate plan in $(job_markdown_ref)" github_pr_comment plan
+            exit 1
+        fi
+
         # Checking plan exit codes
-        for code in $(tac $STEP_TMP_DIR/terraform_plan.stderr | awk '/^[[:space:]]*\*/{flag=1; print} flag && /^[[:space:]]*time=/{exit}' | awk '{print $5}'); do
-            if [[ $code -eq 1 ]]; then
-                STATUS=":x: Failed to generate plan in $(job_markdown_ref)" github_pr_comment plan
-                exit 1
-            fi
-        done
+        if ! terragrunt-run-all-status "$STEP_TMP_DIR/terraform_plan.stderr" >"$STEP_TMP_DIR/terraform_plan_status.json"; then
+            debug_file "$STEP_TMP_DIR/terraform_plan_status.json"
+            STATUS=":x: Failed to generate plan in $(job_markdown_ref)" github_pr_comment plan
+            exit 1
+        fi
 
         if ! STATUS=":memo: Plan generated in $(job_markdown_ref)" github_pr_comment plan ; then
             exit 1
@@ -9,7 +9,12 @@ setup(
     entry_points={
         'console_scripts': [
             'github_pr_comment=github_pr_comment.__main__:main',
-            'lock-info=lock_info.__main__:main'
+            'lock-info=lock_info.__main__:main',
+            'terragrunt-show-all=terraform.exec:show_all_main',
+            'terragrunt-plan-groups=terraform.groups:plan_groups_main',
+            'terragrunt-apply-groups=terraform.groups:apply_groups_main',
+            'terragrunt-run-all-status=terraform.run_all:main',
+            'install-toolchain=terraform.download:install_toolchain_main'
         ]
     },
     install_requires=[
@@ -1,11 +1,19 @@
 import datetime
+import hashlib
+import os
+import random
 import sys
+import time
 from typing import NewType, Iterable, Any, Optional
+from urllib.parse import parse_qs, urlparse
 
 import requests
 from requests import Response
+from urllib3.exceptions import NewConnectionError
 
+from github_actions.cache import ActionsCache
 from github_actions.debug import debug
+from github_actions.http_cache import ConditionalRequestCache
 
 GitHubUrl = NewType('GitHubUrl', str)
 PrUrl = NewType('PrUrl', GitHubUrl)
@@ -14,11 +22,137 @@ CommentUrl = NewType('CommentUrl', GitHubUrl)
 CommentReactionUrl = NewType('CommentReactionUrl', GitHubUrl)
 
 
+class RetryPolicy:
+    """
+    How failed GitHub API requests are retried
+
+    Requests are retried when rate limited, for server errors and for connection errors.
+    POST requests are only retried when rate limited or when the connection could not be made,
+    as otherwise the request may already have been processed.
+    The wait before each retry is taken from the Retry-After or X-RateLimit-Reset response headers if present,
+    otherwise it is an exponential backoff with full jitter.
+    No more retries are made once the total wait would exceed max_total_wait seconds.
+    """
+
+    def __init__(self, max_retries: int = 5, backoff: float = 1.0, max_backoff: float = 60.0, max_total_wait: float = 300.0):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_total_wait = max_total_wait
+
+
+    @classmethod
+    def from_env(cls) -> 'RetryPolicy':
+        """
+        Create a retry policy using the TERRAFORM_ACTIONS_GITHUB_MAX_RETRIES and TERRAFORM_ACTIONS_GITHUB_MAX_RETRY_WAIT
+        environment variables, if they are set.
+        """
+
+        policy = cls()
+
+        try:
+            policy.max_retries = int(os.environ['TERRAFORM_ACTIONS_GITHUB_MAX_RETRIES'])
+        except (ValueError, KeyError):
+            pass
+
+        try:
+            policy.max_total_wait = float(os.environ['TERRAFORM_ACTIONS_GITHUB_MAX_RETRY_WAIT'])
+        except (ValueError, KeyError):
+            pass
+
+        return policy
+
+
+    def backoff_delay(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+
+    def retry_delay(self, method: str, response: Optional[Response], attempt: int, error: Optional[Exception] = None) -> Optional[float]:
+        """
+        How long to wait before retrying a request
+
+        Returns None if the request should not be retried.
+        A response of None means the request failed with the connection error or timeout in error.
+        """
+
+        if response is None:
+            if method.upper() == 'POST' and not _not_sent(error):
+                # The request may have been processed, retrying could create a duplicate
+                return None
+
+            return self.backoff_delay(attempt)
+
+        rate_limited = _is_rate_limited(response)
+
+        if not rate_limited and response.status_code not in [500, 502, 503, 504]:
+            return None
+
+        if not rate_limited and method.upper() == 'POST':
+            # The request may have been processed, retrying could create a duplicate
+            return None
+
+        if retry_after := response.headers.get('Retry-After'):
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+
+        if response.headers.get('X-RateLimit-Remaining') == '0' and 'X-RateLimit-Reset' in response.headers:
+            try:
+                return max(0.0, int(response.headers['X-RateLimit-Reset']) - time.time()) + 1
+            except ValueError:
+                pass
+
+        return self.backoff_delay(attempt)
+
+
+def _not_sent(error: Optional[Exception]) -> bool:
+    """Did the request fail before it was sent to the server"""
+
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+
+    if isinstance(error, requests.ConnectionError) and error.args:
+        return isinstance(getattr(error.args[0], 'reason', error.args[0]), NewConnectionError)
+
+    return False
+
+
+def _is_rate_limited(response: Response) -> bool:
+    if response.status_code == 429:
+        return True
+
+    if response.status_code != 403:
+        return False
+
+    if response.headers.get('X-RateLimit-Remaining') == '0' and response.headers.get('X-RateLimit-Limit') != '0':
+        return True
+
+    if 'Retry-After' in response.headers:
+        return True
+
+    try:
+        return 'secondary rate limit' in response.json().get('message', '')
+    except Exception:
+        return False
+
+
 class GithubApi:
     
-    def __init__(self, host: str, token: Optional[str]):
+    def __init__(self, host: str, token: Optional[str], retry_policy: Optional[RetryPolicy] = None, cache: Optional[ActionsCache] = None):
         self._host = host
         self._token = token
+        self._retry_policy = retry_policy or RetryPolicy.from_env()
+
+        if cache is not None:
+            # Responses are only valid for the same token
+            identity = hashlib.sha256(f'dflook/terraform-github-actions/{token}'.encode()).hexdigest()
+            self._response_cache = ConditionalRequestCache(cache, identity)
+        else:
+            self._response_cache = None
+
+        self._retries = 0
+        self._retry_wait = 0.0
 
         self._session = requests.Session()
 
@@ -29,15 +163,61 @@ class GithubApi:
         self._session.headers['accept'] = 'application/vnd.github.v3+json'
 
 
+    @property
+    def retries(self) -> int:
+        """The number of requests that have been retried"""
+        return self._retries
+
+
+    @property
+    def retry_wait(self) -> float:
+        """The total number of seconds spent waiting to retry requests"""
+        return self._retry_wait
+
+
+    def _request_with_retry(self, method: str, *args, **kwargs) -> requests.Response:
+        waited = 0.0
+        attempt = 0
+
+        while True:
+            error = None
+            try:
+                response = self._session.request(method, *args, **kwargs)
+                debug(f'{response.request.method} {response.request.url} -> {response.status_code}')
+            except (requests.ConnectionError, requests.Timeout) as e:
+                debug(f'{method} request failed: {e}')
+                if attempt >= self._retry_policy.max_retries:
+                    raise
+                response = None
+                error = e
+
+            if attempt < self._retry_policy.max_retries:
+                delay = self._retry_policy.retry_delay(method, response, attempt, error)
+            else:
+                delay = None
+
+            if delay is None or waited + delay > self._retry_policy.max_total_wait:
+                if error is not None:
+                    raise requests.ConnectionError(f'{method} request failed, not retrying after waiting {waited:.1f} seconds') from error
+                return response
+
+            debug(f'Retrying {method} request in {delay:.1f} seconds')
+            time.sleep(delay)
+
+            waited += delay
+            attempt += 1
+            self._retries += 1
+            self._retry_wait += delay
+
+
     def api_request(self, method: str, *args, **kwargs) -> requests.Response:
-        response = self._session.request(method, *args, **kwargs)
-        debug(f'{response.request.method} {response.request.url} -> {response.status_code}')
+        response = self._request_with_retry(method, *args, **kwargs)
 
         if 400 <= response.status_code < 500:
             try:
                 message = response.json()['message']
 
-                if response.headers['X-RateLimit-Remaining'] == '0' and response.headers['X-RateLimit-Limit'] != '0':
+                if response.headers.get('X-RateLimit-Remaining') == '0' and response.headers.get('X-RateLimit-Limit') != '0':
                     limit_reset = datetime.datetime.fromtimestamp(int(response.headers['X-RateLimit-Reset']))
                     sys.stdout.write(message)
                     sys.stdout.write(f' Try again when the rate limit resets at {limit_reset} UTC.\n')
@@ -57,7 +237,32 @@ class GithubApi:
 
 
     def get(self, path: str, **kwargs: Any) -> Response:
-        return self.api_request('GET', path, **kwargs)
+        """
+        Make a GET request
+
+        If the api has a cache, the request is conditional on any previous response for the same url.
+        A 304 Not Modified response is replaced with the previous response.
+        """
+
+        if self._response_cache is None:
+            return self.api_request('GET', path, **kwargs)
+
+        key = self._response_cache.key(path, kwargs.get('params'))
+        conditional_headers = self._response_cache.conditional_headers(key)
+
+        response = self.api_request('GET', path, **kwargs | {'headers': kwargs.get('headers', {}) | conditional_headers})
+
+        if response.status_code == 304 and conditional_headers:
+            if self._response_cache.restore(key, response):
+                return response
+
+            # The cached response was evicted after the request was made
+            response = self.api_request('GET', path, **kwargs)
+
+        if response.status_code == 200:
+            self._response_cache.store(key, response)
+
+        return response
 
 
     def post(self, path: str, **kwargs: Any) -> Response:
@@ -68,9 +273,13 @@ class GithubApi:
         return self.api_request('PATCH', path, **kwargs)
 
 
-    def paged_get(self, url: GitHubUrl, *args, **kwargs) -> Iterable[dict[str, Any]]:
+    def delete(self, path: str, **kwargs: Any) -> Response:
+        return self.api_request('DELETE', path, **kwargs)
+
+
+    def paged_get(self, url: GitHubUrl, **kwargs) -> Iterable[dict[str, Any]]:
         while True:
-            response = self.api_request('GET', url, *args, **kwargs)
+            response = self.get(url, **kwargs)
             response.raise_for_status()
 
             yield from response.json()
@@ -79,3 +288,49 @@ class GithubApi:
                 url = response.links['next']['url']
             else:
                 return
+
+
+    def paged_get_reverse(self, url: GitHubUrl, **kwargs) -> Iterable[dict[str, Any]]:
+        """
+        Get every item in a paged list, starting with the last item
+
+        The first page is fetched to find the last page, which is then followed back to the first page.
+        Pages are identified by the page number in their url, so the first page is never fetched twice.
+        """
+
+        response = self.get(url, **kwargs)
+        response.raise_for_status()
+
+        first_page = response.json()
+
+        if 'last' not in response.links:
+            yield from reversed(first_page)
+            return
+
+        first_page_number = _page_number(url) or int((kwargs.get('params') or {}).get('page', 1))
+        url = response.links['last']['url']
+        page_number = _page_number(url)
+
+        while True:
+            response = self.get(url)
+            response.raise_for_status()
+
+            yield from reversed(response.json())
+
+            prev_page_number = _page_number(response.links['prev']['url']) if 'prev' in response.links else None
+
+            if prev_page_number is None or prev_page_number <= first_page_number or (page_number is not None and prev_page_number >= page_number):
+                yield from reversed(first_page)
+                return
+
+            url = response.links['prev']['url']
+            page_number = prev_page_number
+
+
+def _page_number(url: str) -> Optional[int]:
+    """The page number in the query of a paged list url, or None if there isn't one"""
+
+    try:
+        return int(parse_qs(urlparse(url).query)['page'][0])
+    except (KeyError, IndexError, ValueError):
+        return None
@@ -1,37 +1,280 @@
+"""
+A simple key-value store of files in a directory
+
+The same cache directory can be shared by concurrent processes, e.g. JOB_TMP_DIR on a self-hosted runner.
+Values are written to a temporary file and renamed into place, so readers never see a partial value.
+Changes to the index of entries are made while holding an exclusive lock on a lock file in the cache directory.
+
+Entries can have a time to live, after which they are no longer returned. If a maximum size is set, the least
+recently used entries are removed once the total size of the values in the cache exceeds it.
+Values that have already been read or written by this process are kept in memory until the index is changed by
+another process.
+"""
+
+import fcntl
+import json
 import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
 from pathlib import Path
+from typing import Iterator, Optional, Tuple, Union
 
 from github_actions.debug import debug
 
+_INDEX = '.actions_cache_index'
+_LOCK = '.actions_cache_lock'
+
 
 class ActionsCache:
+    """
+    A cache of values stored in files in cache_dir
+
+    Values can be str or bytes. Indexing returns a str; use get_bytes to read a binary value.
 
-    def __init__(self, cache_dir: Path, label: str=None):
+    :param cache_dir: The directory the values are stored in
+    :param label: The name of the cache used in debug messages
+    :param ttl: The default time to live of entries in seconds, or None if entries don't expire
+    :param max_size: The maximum total size of the values in bytes, or None for no limit
+    """
+
+    def __init__(self, cache_dir: Path, label: str=None, ttl: Optional[float]=None, max_size: Optional[int]=None):
         self._cache_dir = cache_dir
         self._label = label or self._cache_dir
+        self._ttl = ttl
+        self._max_size = max_size
 
+        # key -> (value, expires)
+        self._memory: dict[str, Tuple[bytes, Optional[float]]] = {}
+        # key -> [size, expires]
+        self._index: Optional[dict[str, list]] = None
+        # (inode, mtime) of the index file when it was read, to notice changes made by other processes
+        self._index_version: Optional[Tuple[int, int]] = None
+        self._thread_lock = threading.RLock()
+
+
+    @contextmanager
+    def _lock(self) -> Iterator[None]:
+        """Hold an exclusive lock on the cache directory, shared with other processes"""
+
+        with self._thread_lock:
+            os.makedirs(self._cache_dir, exist_ok=True)
+            with open(os.path.join(self._cache_dir, _LOCK), 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+    def _index_file_version(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(os.path.join(self._cache_dir, _INDEX))
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+
+    def _read_index(self) -> dict[str, list]:
+        try:
+            with open(os.path.join(self._cache_dir, _INDEX)) as f:
+                stat = os.fstat(f.fileno())
+                version = stat.st_ino, stat.st_mtime_ns
+                self._index = json.load(f)
+        except (OSError, ValueError):
+            version = None
+            self._index = {}
+
+        if version != self._index_version:
+            # Entries may have been changed by another process, so values kept in memory can't be trusted
+            self._memory.clear()
+            self._index_version = version
+
+        return self._index
+
+
+    def _load_index(self) -> dict[str, list]:
+        """
+        Return the index, reading it again if the index file has changed since it was last read
+
+        The index file is always replaced rather than modified, so a change made by any process changes its version.
+        """
+
+        version = self._index_file_version()
+
+        with self._thread_lock:
+            if self._index is None or version != self._index_version:
+                return self._read_index()
+            return self._index
+
+
+    def _write(self, path: str, value: bytes) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=f'.{os.path.basename(path)}.')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(value)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+
+
+    def _save_index(self) -> None:
+        self._write(os.path.join(self._cache_dir, _INDEX), json.dumps(self._index, separators=(',', ':')).encode())
+        self._index_version = self._index_file_version()
+
+
+    @staticmethod
+    def _expired(expires: Optional[float]) -> bool:
+        return expires is not None and expires <= time.time()
+
+
+    def set(self, key: str, value: Union[str, bytes], ttl: Optional[float]=None) -> None:
+        """
+        Store a value in the cache
+
+        If ttl is not given the default ttl of the cache is used.
+        """
 
-    def __setitem__(self, key, value):
         if value is None:
             debug(f'Cache value for {key} should not be set to {value}')
             return
 
-        path = os.path.join(self._cache_dir, key)
+        if isinstance(value, str):
+            value = value.encode()
 
-        os.makedirs(os.path.dirname(path), exist_ok=True)
-        with open(os.path.join(self._cache_dir, key), 'w') as f:
-            f.write(value)
-            debug(f'Wrote {key} to {self._label}')
+        ttl = ttl if ttl is not None else self._ttl
+        expires = time.time() + ttl if ttl is not None else None
 
+        with self._lock():
+            self._write(os.path.join(self._cache_dir, key), value)
 
-    def __getitem__(self, key):
-        if os.path.isfile(os.path.join(self._cache_dir, key)):
-            with open(os.path.join(self._cache_dir, key)) as f:
-                debug(f'Read {key} from {self._label}')
-                return f.read()
+            index = self._read_index()
+            index[key] = [len(value), expires]
+            self._evict(keep=key)
+            self._save_index()
+
+            self._memory[key] = (value, expires)
 
-        raise IndexError(key)
+        debug(f'Wrote {key} to {self._label}')
+
+
+    def _load(self, key: str) -> Optional[bytes]:
+        """Return the value for key, or None if it is not in the cache or has expired"""
+
+        with self._thread_lock:
+            index = self._load_index()
+
+            if key in self._memory:
+                value, expires = self._memory[key]
+                if not self._expired(expires):
+                    return value
+                del self._memory[key]
+
+            size, expires = index.get(key, [None, None])
+            if self._expired(expires):
+                return None
+
+            path = os.path.join(self._cache_dir, key)
+            try:
+                with open(path, 'rb') as f:
+                    value = f.read()
+            except (FileNotFoundError, IsADirectoryError, NotADirectoryError):
+                return None
+
+            try:
+                # Record the use of the entry for LRU eviction
+                os.utime(path)
+            except OSError:
+                pass
+
+            self._memory[key] = (value, expires)
+            debug(f'Read {key} from {self._label}')
+            return value
+
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+
+    def get_bytes(self, key: str) -> bytes:
+        value = self._load(key)
+        if value is None:
+            raise IndexError(key)
+        return value
+
+
+    def __getitem__(self, key):
+        return self.get_bytes(key).decode()
 
 
     def __contains__(self, key):
+        entry = self._load_index().get(key)
+        if entry is not None and self._expired(entry[1]):
+            return False
+
         return os.path.isfile(os.path.join(self._cache_dir, key))
+
+
+    def __delitem__(self, key):
+        with self._lock():
+            self._memory.pop(key, None)
+
+            index = self._read_index()
+            if key in index:
+                del index[key]
+                self._save_index()
+
+            if os.path.isfile(os.path.join(self._cache_dir, key)):
+                os.remove(os.path.join(self._cache_dir, key))
+                debug(f'Removed {key} from {self._label}')
+
+
+    def _evict(self, keep: str) -> None:
+        """
+        Remove expired entries, then the least recently used entries until the cache is within max_size
+
+        Must be called while holding the lock.
+        """
+
+        index = self._index
+
+        def remove(key: str) -> None:
+            del index[key]
+            self._memory.pop(key, None)
+            try:
+                os.remove(os.path.join(self._cache_dir, key))
+            except FileNotFoundError:
+                pass
+
+        for key, (_, expires) in list(index.items()):
+            if key != keep and self._expired(expires):
+                debug(f'Expiring {key} from {self._label}')
+                remove(key)
+
+        if self._max_size is None:
+            return
+
+        total_size = sum(size for size, _ in index.values())
+        if total_size <= self._max_size:
+            return
+
+        def last_used(key: str) -> float:
+            try:
+                return os.stat(os.path.join(self._cache_dir, key)).st_mtime
+            except FileNotFoundError:
+                return 0
+
+        for key in sorted(index, key=last_used):
+            if total_size <= self._max_size:
+                return
+            if key == keep:
+                continue
+
+            debug(f'Evicting {key} from {self._label}')
+            total_size -= index[key][0]
+            remove(key)
@@ -13,6 +13,8 @@ class ActionsEnv(TypedDict):
     TERRAFORM_HTTP_CREDENTIALS: str
     TERRAFORM_VERSION: str
     TERRAFORM_ACTIONS_GITHUB_TOKEN: str
+    TERRAFORM_ACTIONS_GITHUB_MAX_RETRIES: str
+    TERRAFORM_ACTIONS_GITHUB_MAX_RETRY_WAIT: str
     OPENTOFU_VERSION: str
     OPENTOFU: str
 
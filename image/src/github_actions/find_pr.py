@@ -1,9 +1,11 @@
+import hashlib
 import json
 import os
 import re
 from typing import Optional, Any, cast, Iterable
 
 from github_actions.api import PrUrl, GithubApi
+from github_actions.cache import ActionsCache
 from github_actions.debug import debug
 from github_actions.env import GithubEnv
 
@@ -12,10 +14,12 @@ class WorkflowException(Exception):
     """An exception that should result in an error in the workflow log"""
 
 
-def find_pr(github: GithubApi, actions_env: GithubEnv) -> PrUrl:
+def find_pr(github: GithubApi, actions_env: GithubEnv, cache: Optional[ActionsCache] = None) -> PrUrl:
     """
     Find the pull request this event is related to
 
+    For push events the PR is found by the merge commit sha. If a cache is given, the PR found for a commit is stored in it.
+
     >>> find_pr()
     'https://api.github.com/repos/dflook/terraform-github-actions/pulls/8'
 
@@ -70,13 +74,29 @@ def find_pr(github: GithubApi, actions_env: GithubEnv) -> PrUrl:
         repo = actions_env['GITHUB_REPOSITORY']
         commit = actions_env['GITHUB_SHA']
 
-        def prs() -> Iterable[dict[str, Any]]:
-            url = cast(PrUrl, f'{actions_env["GITHUB_API_URL"]}/repos/{repo}/pulls')
-            yield from github.paged_get(url, params={'state': 'all'})
+        cache_key = f'pr-url/{hashlib.sha256(f"{repo}/{commit}".encode()).hexdigest()}'
+        if cache is not None and cache_key in cache:
+            return cast(PrUrl, cache[cache_key])
 
-        for pr in prs():
-            if pr['merge_commit_sha'] == commit:
-                return cast(PrUrl, pr['url'])
+        def associated_prs() -> Iterable[dict[str, Any]]:
+            # The PRs the commit is associated with, which is usually just the PR it was merged from
+            url = f'{actions_env["GITHUB_API_URL"]}/repos/{repo}/commits/{commit}/pulls'
+            response = github.get(url)
+            if response.ok:
+                yield from response.json()
+            else:
+                debug(f'Unable to get PRs associated with commit {commit}')
+
+        def all_prs() -> Iterable[dict[str, Any]]:
+            url = cast(PrUrl, f'{actions_env["GITHUB_API_URL"]}/repos/{repo}/pulls')
+            yield from github.paged_get(url, params={'state': 'all', 'per_page': 100})
+
+        for prs in [associated_prs, all_prs]:
+            for pr in prs():
+                if pr['merge_commit_sha'] == commit:
+                    if cache is not None:
+                        cache[cache_key] = pr['url']
+                    return cast(PrUrl, pr['url'])
 
         raise WorkflowException(f'No PR found in {repo} for commit {commit} (was it pushed directly to the target branch?)')
 
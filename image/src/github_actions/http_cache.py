@@ -0,0 +1,91 @@
+"""
+Conditional request cache for GitHub API reads
+
+GitHub responses include an ETag and often a Last-Modified header. Sending these back in If-None-Match and
+If-Modified-Since headers gets a 304 Not Modified response if nothing has changed, which doesn't count against
+the rate limit. The body of the 304 response is empty, so the previous response body is kept in an ActionsCache.
+"""
+
+import hashlib
+import json
+from typing import Any, Optional
+
+from requests import Response
+
+from github_actions.cache import ActionsCache
+from github_actions.debug import debug
+
+# Response headers that are needed to reuse a cached response
+_cached_headers = ['ETag', 'Last-Modified', 'Link', 'Content-Type']
+
+
+class ConditionalRequestCache:
+    """
+    Stores GitHub API responses by url, for making conditional requests
+
+    Entries are evicted by the ActionsCache they are stored in, so an entry may disappear at any time.
+    """
+
+    def __init__(self, cache: ActionsCache, identity: str = ''):
+        self._cache = cache
+        self._identity = identity
+
+
+    def key(self, url: str, params: Any = None) -> str:
+        request = json.dumps({'identity': self._identity, 'url': url, 'params': params}, sort_keys=True, default=str)
+        return f'http-cache/{hashlib.sha256(request.encode()).hexdigest()}'
+
+
+    def _entry(self, key: str) -> Optional[dict[str, Any]]:
+        try:
+            return json.loads(self._cache[key])
+        except (IndexError, ValueError):
+            return None
+
+
+    def conditional_headers(self, key: str) -> dict[str, str]:
+        """The request headers to make a request conditional on the cached response for key"""
+
+        entry = self._entry(key)
+        if entry is None:
+            return {}
+
+        headers = {}
+        if etag := entry['headers'].get('ETag'):
+            headers['If-None-Match'] = etag
+        if last_modified := entry['headers'].get('Last-Modified'):
+            headers['If-Modified-Since'] = last_modified
+
+        return headers
+
+
+    def restore(self, key: str, response: Response) -> bool:
+        """
+        Turn a 304 Not Modified response into the cached response
+
+        Returns False if the cached response is no longer available, in which case the response is unchanged.
+        """
+
+        entry = self._entry(key)
+        if entry is None:
+            debug(f'Cached response for {response.url} has been evicted')
+            return False
+
+        response.status_code = 200
+        response._content = entry['body'].encode()
+        response.headers.update(entry['headers'])
+
+        debug(f'Using cached response for {response.url}')
+        return True
+
+
+    def store(self, key: str, response: Response) -> None:
+        """
+        Store a response, if it can be used for a conditional request
+        """
+
+        headers = {name: response.headers[name] for name in _cached_headers if name in response.headers}
+        if 'ETag' not in headers and 'Last-Modified' not in headers:
+            return
+
+        self._cache[key] = json.dumps({'headers': headers, 'body': response.content.decode()})
@@ -33,6 +33,7 @@ class PlanPrInputs(PlanInputs):
     INPUT_TARGET: str
     INPUT_REPLACE: str
     INPUT_DESTROY: str
+    INPUT_PLAN_HASH: str
 
 
 class Plan(PlanPrInputs):
@@ -1,9 +1,9 @@
 import hashlib
 import os
-import re
 import sys
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from pathlib import Path
-from typing import (NewType, Optional, cast, Tuple, List)
+from typing import (NewType, Optional, cast, List, Set, Tuple)
 
 import canonicaljson
 
@@ -15,20 +15,23 @@ from github_actions.env import GithubEnv
 from github_actions.find_pr import find_pr, WorkflowException
 from github_actions.inputs import PlanPrInputs
 from github_pr_comment.comment import find_comment, TerraformComment, update_comment, serialize, deserialize
-from github_pr_comment.hash import plan_hash
+from github_pr_comment.plan_index import PlanFile, ingest_plans, load_plans
 
 Plan = NewType('Plan', str)
 Status = NewType('Status', str)
 
-job_cache = ActionsCache(Path(os.environ.get('JOB_TMP_DIR', '.')), 'job_cache')
+# JOB_TMP_DIR persists between jobs on self-hosted runners, so entries expire and the total size is limited
+job_cache = ActionsCache(Path(os.environ.get('JOB_TMP_DIR', '.')), 'job_cache', ttl=24 * 60 * 60, max_size=64 * 1024 * 1024)
 step_cache = ActionsCache(Path(os.environ.get('STEP_TMP_DIR', '.')), 'step_cache')
 
 env = cast(GithubEnv, os.environ)
 github_token = env['TERRAFORM_ACTIONS_GITHUB_TOKEN']
-github = GithubApi(env.get('GITHUB_API_URL', 'https://api.github.com'), github_token)
+github = GithubApi(env.get('GITHUB_API_URL', 'https://api.github.com'), github_token, cache=job_cache)
 
 ToolProductName = os.environ.get('TOOL_PRODUCT_NAME', 'Terragrunt')
 
+plan_json_dir = Path(os.environ.get('STEP_TMP_DIR', '.'), 'plan_json')
+
 def job_markdown_ref() -> str:
     return f'[{os.environ["GITHUB_WORKFLOW"]} #{os.environ["GITHUB_RUN_NUMBER"]}]({os.environ["GITHUB_SERVER_URL"]}/{os.environ["GITHUB_REPOSITORY"]}/actions/runs/{os.environ["GITHUB_RUN_ID"]})'
 
@@ -96,60 +99,12 @@ def format_description(action_inputs: PlanPrInputs) -> str:
     return label
 
 
-def create_plan_hashes(folder_path: str, salt: str) -> Optional[List[dict]]:
-    plan_hashes = []
-
-    for file in os.listdir(folder_path):
-        file_path = Path(os.path.join(folder_path, file)) 
-        hash_section = {}
-        hash_section['plan_name'] = file
-        hash_section['plan_hash'] = plan_hash(file_path.read_text().strip(), salt)
-        plan_hashes.append(hash_section)
+def create_plan_hashes(plans: List[PlanFile]) -> List[dict]:
+    return [{'plan_name': plan.name, 'plan_hash': plan.plan_hash} for plan in plans]
 
-    return plan_hashes
 
-
-def create_sections(folder_path: str) -> Optional[List[dict]]:
-    sections = []
-
-    for file in os.listdir(folder_path):
-        file_path = os.path.join(folder_path, file)
-        
-        module_name = file.replace("___","/")
-
-        section = {}
-        body = []
-        summary = None
-        to_move = 0
-
-        with open(file_path, 'r') as plan:
-            lines = plan.readlines()
-
-            for line in lines:
-                            
-                if line.startswith('No changes') or line.startswith('Error'):
-                    summary = line
-
-                if re.match(r'  # \S+ has moved to \S+$', line):
-                    to_move += 1
-
-                if line.startswith('Plan:'):
-                    summary = line
-                    if to_move and 'move' not in summary:
-                        summary = summary.rstrip('.') + f', {to_move} to move.'
-                
-                if line.startswith('Changes to Outputs'):
-                    if summary:
-                        summary = summary + ' Changes to Outputs.'
-                    else:
-                        summary = line
-                
-                body.append(line)
-            
-        summary = f'{module_name}: {summary}'
-        section['summary'] = summary  
-        section['body'] = ''.join(body)
-        sections.append(section)
+def create_sections(plans: List[Tuple[PlanFile, str]]) -> Optional[List[dict]]:
+    sections = [{'summary': plan.summary, 'body': body} for plan, body in plans]
 
     if sections:
         return sections
@@ -193,9 +148,19 @@ def current_user(actions_env: GithubEnv) -> str:
 
         # Not all tokens can be used with graphql
         # There is also no rest endpoint that can get the current login for app tokens :(
-        # Try graphql first, then fallback to rest (e.g. for fine grained PATs)
+        # Try graphql and rest (e.g. for fine grained PATs) at the same time, and use whichever answers first
+
+        username = None
+
+        executor = ThreadPoolExecutor(max_workers=2)
+        pending = {executor.submit(graphql), executor.submit(rest)}
 
-        username = graphql() or rest()
+        while pending and username is None:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                username = username or future.result()
+
+        executor.shutdown(wait=False)
 
         if username is None:
             debug('Unable to get username for the github token')
@@ -228,7 +193,7 @@ def get_pr() -> PrUrl:
         pr_url = step_cache['pr_url']
     else:
         try:
-            pr_url = find_pr(github, env)
+            pr_url = find_pr(github, env, job_cache)
             step_cache['pr_url'] = pr_url
         except WorkflowException as e:
             sys.stderr.write('\n' + str(e) + '\n')
@@ -239,11 +204,19 @@ def get_pr() -> PrUrl:
 
 def get_comment(action_inputs: PlanPrInputs) -> TerraformComment:
     if 'comment' in step_cache:
-        return deserialize(step_cache['comment'])
+        try:
+            return deserialize(step_cache.get_bytes('comment'))
+        except ValueError as e:
+            debug(f'Unable to use cached comment: {e}')
+
+    # The username is fetched while the issue url is found
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        username_future = executor.submit(current_user, env)
 
-    pr_url = get_pr()
-    issue_url = get_issue_url(pr_url)
-    username = current_user(env)
+        pr_url = get_pr()
+        issue_url = get_issue_url(pr_url)
+
+        username = username_future.result()
 
     legacy_description = format_classic_description(action_inputs)
 
@@ -261,51 +234,32 @@ def get_comment(action_inputs: PlanPrInputs) -> TerraformComment:
 
     backup_headers = headers.copy()
 
-    return find_comment(github, issue_url, username, headers, backup_headers, legacy_description)
-
+    return find_comment(github, issue_url, username, headers, backup_headers, legacy_description, job_cache)
 
-def is_approved(folder_path: str, comment: TerraformComment) -> bool:
 
-    for file in os.listdir(folder_path):
-        file_path = Path(os.path.join(folder_path, file)) 
-        
-        for hash in comment.headers.get('plan_hashes'):
-            if hash.get('plan_name') == file:
-                if hash.get('plan_hash') == plan_hash(file_path.read_text().strip(), comment.issue_url):
-                    continue
-                else:
-                    return False
-
-    debug('Approving plan based on plan hash')     
-    return True
-
-def format_plan_text(plan_text: str) -> Tuple[str, str]:
-    """
-    Format the given plan for insertion into a PR comment
+def changed_plans(plans: List[PlanFile], comment: TerraformComment) -> Set[str]:
     """
+    Find the modules with a plan that doesn't match the plan hash in the comment
 
-    max_body_size = 50000  # bytes
+    Returns the module path of every plan that has changed, including plans that aren't in the comment.
+    """
 
-    def truncate(t):
-        lines = []
-        total_size = 0
+    expected = {hash.get('plan_name'): hash.get('plan_hash') for hash in comment.headers.get('plan_hashes') or []}
 
-        for line in t.splitlines():
-            line_size = len(line.encode()) + 1  # + newline
-            if total_size + line_size > max_body_size:
-                lines.append('Plan is too large to fit in a PR comment. See the full plan in the workflow log.')
-                break
+    return {
+        plan.module_path for plan in plans
+        if expected.get(plan.name) is None or expected[plan.name] != plan.plan_hash
+    }
 
-            lines.append(line)
-            total_size += line_size
 
-        return '\n'.join(lines)
+def is_approved(plans: List[PlanFile], comment: TerraformComment) -> bool:
+    if changed := changed_plans(plans, comment):
+        for module_path in sorted(changed):
+            sys.stdout.write(f'The plan for {module_path} has changed\n')
+        return False
 
-    if len(plan_text.encode()) > max_body_size:
-        # needs truncation
-        return 'trunc', truncate(plan_text)
-    else:
-        return 'text', plan_text
+    debug('Approving plan based on plan hash')
+    return True
 
 
 def main() -> int:
@@ -333,13 +287,22 @@ def main() -> int:
 
         headers = comment.headers.copy()
         headers['plan_job_ref'] = job_workflow_ref()
-        headers['plan_hashes'] = create_plan_hashes(plan_path, comment.issue_url)
+        plan_hash_format = 'json' if os.environ.get('INPUT_PLAN_HASH') == 'json' else 'text'
+
+        # Each plan file is read once, for both the sections and the plan hashes
+        ingested = list(ingest_plans(plan_path, comment.issue_url, plan_hash_format, plan_json_dir))
+
+        headers['plan_hashes'] = create_plan_hashes([plan for plan, _ in ingested])
+        if plan_hash_format == 'json':
+            headers['plan_hash_format'] = plan_hash_format
+        else:
+            headers.pop('plan_hash_format', None)
 
         comment = update_comment(
             github,
             comment,
             description=description,
-            sections=create_sections(plan_path),
+            sections=create_sections(ingested),
             headers=headers,
             status=status
         )
@@ -368,17 +331,26 @@ def main() -> int:
             sys.exit(1)
 
 
-        num_of_plan_files = len([name for name in os.listdir(plan_path) if os.path.isfile(os.path.join(plan_path, name))])
-        num_of_plans_in_comment = len(comment.sections)
+        try:
+            workers = int(action_inputs.get('INPUT_PARALLELISM', '0')) or None
+        except ValueError:
+            workers = None
+
+        plans = load_plans(plan_path, comment.issue_url, comment.headers.get('plan_hash_format', 'text'), plan_json_dir, step_cache, workers)
+
+        num_of_plan_files = len(plans)
+        num_of_plans_in_comment = comment.section_count
         if num_of_plan_files != num_of_plans_in_comment:
             sys.stdout.write("The number of plans in PR doesn't match the current number of plans.\n")
             sys.stdout.write("Regenerate the plan first using the Fenikks/terragrunt-plan-all action.\n")
             output('failure-reason', 'number-of-plans-changed')
             sys.exit(1)
 
-        if not is_approved(plan_path, comment, ):
+        if not is_approved(plans, comment):
 
             sys.stdout.write("Not applying the plan - it has changed from the plan on the PR\n")
+            if comment.headers.get('plan_hash_format') == 'json' and os.environ.get('INPUT_PLAN_HASH') != 'json':
+                sys.stdout.write("The plan on the PR was hashed using the JSON plan. Set the plan_hash input to 'json' to apply it\n")
             sys.stdout.write("The plan on the PR must be up to date. Alternatively, set the auto_approve input to 'true' to apply outdated plans\n")
             comment = update_comment(github, comment, status=f':x: Plan not applied in {job_markdown_ref()} (Plan has changed)')
 
@@ -1,10 +1,14 @@
+import hashlib
 import json
 import os
 import re
+import struct
+import zlib
 from json import JSONDecodeError
-from typing import Optional, Any, List
+from typing import Optional, Any, List, Tuple, Union
 
 from github_actions.api import IssueUrl, GithubApi, CommentUrl
+from github_actions.cache import ActionsCache
 from github_actions.debug import debug
 
 try:
@@ -12,6 +16,24 @@ try:
 except (ValueError, KeyError):
     collapse_threshold = 10
 
+# GitHub rejects comments longer than 65536 characters. Comment shards are packed to this many bytes,
+# which leaves some room for the parts of the header that are only known once the shards are packed.
+max_comment_size = 65000
+
+# Headers that are only present on the first comment of a sharded comment
+_primary_only_headers = ['plan_job_ref', 'plan_hash_format', 'shards']
+
+# Headers that are not included in the digest of a comment, so changing only these doesn't update the comment
+_undigested_headers = ['digest', 'version']
+_digest_header_size = len(json.dumps({'digest': '0' * 64}, separators=(',', ':')))
+
+# Encodes JSON without whitespace, without creating a new encoder for every plan hash entry
+_compact_json = json.JSONEncoder(separators=(',', ':'))
+
+# The start of a comment serialized by serialize(), followed by a version byte
+_serialized_magic = b'TFCOMMENT'
+_serialized_version = 1
+
 from pkg_resources import get_distribution, DistributionNotFound
 
 try:
@@ -19,6 +41,49 @@ try:
 except DistributionNotFound:
     version = '0.0.0'
 
+class _Compressed:
+    """
+    A list stored as compressed JSON, which is only decoded when it is needed
+    """
+
+    def __init__(self, data: bytes, length: int):
+        self.data = data
+        self.length = length
+
+
+    @classmethod
+    def encode(cls, value: list) -> '_Compressed':
+        return cls(zlib.compress(json.dumps(value, separators=(',', ':')).encode()), len(value))
+
+
+    def decode(self) -> list:
+        return json.loads(zlib.decompress(self.data))
+
+
+class _ShardLayout:
+    """
+    The rendered sections and plan hashes of one comment in a sharded comment
+
+    digests has the section digest of each rendered section, or None if it isn't known.
+    """
+
+    def __init__(self, sections: Union[List[str], _Compressed], plan_hashes: Optional[List[dict]], digests: List[Optional[str]]):
+        self._sections = sections
+        self.plan_hashes = plan_hashes
+        self.digests = digests
+
+
+    @property
+    def sections(self) -> List[str]:
+        if isinstance(self._sections, _Compressed):
+            self._sections = self._sections.decode()
+        return self._sections
+
+
+    def compressed_sections(self) -> _Compressed:
+        return self._sections if isinstance(self._sections, _Compressed) else _Compressed.encode(self._sections)
+
+
 class TerraformComment:
     """
     Represents a Terraform PR comment
@@ -36,19 +101,56 @@ class TerraformComment:
         'plan_modifier',  # Hash of plan modifiers (target/replace options)
         'plan_job_ref',   # A text reference to the actions job that generated the plan
         'plan_hash',      # A deterministic hash of the plan (without warnings or unchanged attributes, eventually with unmasked variables)
+        'plan_hash_format', # 'json' if the plan hashes were computed from the JSON plan rather than the plan text
         'variables_hash', # A hash of input variables and values
-        'truncated'       # If the plan text has been truncated (should not be used to approve plans, and will not show a complete diff)
+        'truncated',      # If the plan text has been truncated (should not be used to approve plans, and will not show a complete diff)
+        'shards',         # The number of comments the plan is split over, if more than one
+        'shard',          # The position of this comment in a sharded comment. Only present on continuation comments.
+        'digest'          # A hash of the rendered comment, used to skip updating a comment that hasn't changed
     ]
 
+    Each plan_hashes entry also has a 'section_digest', which is a hash of the section for that plan. When the comment
+    is updated, sections with the same digest are not rendered again, and are kept in the same shard if possible.
+
+    A comment that is too large for GitHub is split over multiple comments, called shards.
+    The first comment has the description, the status and as many sections as fit. Any remaining sections
+    are in continuation comments, which have a 'shard' header. Each shard has the plan_hashes for its own
+    sections.
+
     """
 
-    def __init__(self, *, issue_url: IssueUrl, comment_url: Optional[CommentUrl], headers: dict[str, str], description: str, sections: List[dict], status: str):
+    def __init__(self, *, issue_url: IssueUrl, comment_url: Optional[CommentUrl], headers: dict[str, str], description: str, sections: Union[List[dict], _Compressed], status: str, shards: Optional[List[dict]] = None):
         self._issue_url = issue_url
         self._comment_url = comment_url
         self._headers = headers
         self._description = description.strip()
         self._sections = sections
         self._status = status.strip()
+        self._shards = shards or []
+
+        # How the sections were packed into comments when the comment was last rendered
+        self._packed_layout: Optional[List[_ShardLayout]] = None
+
+        # The parsed GitHub comments of a comment found on the PR, which the layout is worked out from when it's needed
+        self._parsed_parts: Optional[List[TerraformComment]] = None
+
+        # For a comment parsed from the GitHub API, the body and the position of each section's rendered text in it
+        self._body: Optional[str] = None
+        self._section_spans: List[Tuple[int, int]] = []
+
+
+    @property
+    def _layout(self) -> Optional[List[_ShardLayout]]:
+        if self._parsed_parts is not None:
+            self._packed_layout = _parsed_layout(self, self._parsed_parts)
+            self._parsed_parts = None
+        return self._packed_layout
+
+
+    @_layout.setter
+    def _layout(self, layout: Optional[List[_ShardLayout]]) -> None:
+        self._packed_layout = layout
+        self._parsed_parts = None
 
 
     def __eq__(self, other):
@@ -60,8 +162,9 @@ class TerraformComment:
             self._comment_url == other._comment_url and
             self._headers == other._headers and
             self._description == other._description and
-            self._sections == other._sections and
-            self._status == other._status
+            self.sections == other.sections and
+            self._status == other._status and
+            self._shards == other._shards
         )
 
 
@@ -70,7 +173,7 @@ class TerraformComment:
 
 
     def __repr__(self):
-        return f'TerraformComment(issue_url={self._issue_url!r}, comment_url={self._comment_url!r}, headers={self._headers!r}, description={self._description!r}, sections={self._sections!r}, status={self._status!r})'
+        return f'TerraformComment(issue_url={self._issue_url!r}, comment_url={self._comment_url!r}, headers={self._headers!r}, description={self._description!r}, sections={self.sections!r}, status={self._status!r}, shards={self._shards!r})'
 
 
     @property
@@ -101,41 +204,161 @@ class TerraformComment:
 
 
     @property
-    def sections(self) -> str:
+    def sections(self) -> List[dict]:
+        if isinstance(self._sections, _Compressed):
+            self._sections = self._sections.decode()
         return self._sections
 
 
+    @property
+    def section_count(self) -> int:
+        """The number of sections, without decoding them"""
+        if isinstance(self._sections, _Compressed):
+            return self._sections.length
+        return len(self._sections) if isinstance(self._sections, list) else 0
+
+
     @property
     def status(self) -> str:
         return self._status
 
 
-def serialize(comment: TerraformComment) -> str:
-    return json.dumps({
+    @property
+    def shards(self) -> List[dict]:
+        """The continuation comments of a sharded comment, in order. Each is a dict with a 'url' and 'digest'."""
+        return self._shards
+
+
+def serialize(comment: TerraformComment) -> bytes:
+    """
+    Encode a comment for the step cache
+
+    The encoding is the magic bytes, a version byte, the number of parts and the length of each part, followed by
+    the parts. Each part is zlib compressed JSON. The first part has everything except the sections, the second
+    has the sections, and each following part has the rendered sections of one comment of a sharded comment.
+    Sections that were never decoded are written back without being decompressed.
+    """
+
+    layout = comment._layout or []
+
+    meta = {
         'issue_url': comment.issue_url,
         'comment_url': comment.comment_url,
         'headers': comment.headers,
         'description': comment.description,
-        'sections': comment.sections,
-        'status': comment.status
-    })
+        'status': comment.status,
+        'shards': comment.shards,
+        'section_count': comment.section_count,
+        'layout': [{'plan_hashes': shard.plan_hashes, 'digests': shard.digests, 'section_count': shard.compressed_sections().length} for shard in layout] if layout else None
+    }
+
+    sections = comment._sections if isinstance(comment._sections, _Compressed) else _Compressed.encode(comment.sections)
+
+    parts = [
+        zlib.compress(json.dumps(meta, separators=(',', ':')).encode()),
+        sections.data,
+        *(shard.compressed_sections().data for shard in layout)
+    ]
 
+    return b''.join([
+        _serialized_magic,
+        bytes([_serialized_version]),
+        struct.pack(f'>I{len(parts)}I', len(parts), *(len(part) for part in parts)),
+        *parts
+    ])
 
-def deserialize(s) -> TerraformComment:
-    j = json.loads(s)
 
-    return TerraformComment(
-        issue_url=j['issue_url'],
-        comment_url=j['comment_url'],
-        headers=j['headers'],
-        description=j['description'],
-        sections=j['sections'],
-        status=j['status']
+def deserialize(s: Union[str, bytes]) -> TerraformComment:
+    """
+    Decode a comment from the step cache
+
+    The sections are only decompressed when they are used.
+    Comments serialized as plain JSON by earlier versions can also be decoded.
+    Raises ValueError if the comment was serialized by an unknown version.
+    """
+
+    if isinstance(s, str) or not s.startswith(_serialized_magic):
+        j = json.loads(s)
+
+        return TerraformComment(
+            issue_url=j['issue_url'],
+            comment_url=j['comment_url'],
+            headers=j['headers'],
+            description=j['description'],
+            sections=j['sections'],
+            status=j['status'],
+            shards=j.get('shards')
+        )
+
+    pos = len(_serialized_magic)
+    if s[pos] != _serialized_version:
+        raise ValueError(f'Unknown serialized comment version {s[pos]}')
+    pos += 1
+
+    (part_count,) = struct.unpack_from('>I', s, pos)
+    lengths = struct.unpack_from(f'>{part_count}I', s, pos + 4)
+    pos += 4 + 4 * part_count
+
+    parts = []
+    for length in lengths:
+        parts.append(s[pos:pos + length])
+        pos += length
+
+    meta = json.loads(zlib.decompress(parts[0]))
+
+    comment = TerraformComment(
+        issue_url=meta['issue_url'],
+        comment_url=meta['comment_url'],
+        headers=meta['headers'],
+        description=meta['description'],
+        sections=_Compressed(parts[1], meta['section_count']),
+        status=meta['status'],
+        shards=meta['shards']
     )
 
+    if meta['layout']:
+        comment._layout = [
+            _ShardLayout(_Compressed(data, shard['section_count']), shard['plan_hashes'], shard['digests'])
+            for shard, data in zip(meta['layout'], parts[2:])
+        ]
+
+    return comment
+
 
 def _format_comment_header(**kwargs) -> str:
-    return f'<!-- dflook/terraform-github-actions {json.dumps(kwargs, separators=(",",":"))} -->'
+    return f'<!-- dflook/terraform-github-actions {_compact_json.encode(kwargs)} -->'
+
+
+def _split_header(body: str) -> Tuple[Optional[str], int]:
+    """
+    Find the HTML comment at the start of a comment body
+
+    Returns the header (including the trailing newline), or None if there isn't one, and the position in body
+    just after it.
+    """
+
+    if not body.startswith('<!--'):
+        return None, 0
+
+    end = body.find('-->\n')
+    if end == -1:
+        return None, 0
+
+    return body[:end + 4], end + 4
+
+
+def _parse_header_line(body: str) -> Optional[dict[str, str]]:
+    """
+    Parse only the header of a comment body
+
+    This only looks at the start of the body, so is much cheaper than parsing the whole comment.
+    Returns None if the comment doesn't start with a header
+    """
+
+    if not body.startswith('<!-- dflook/terraform-github-actions'):
+        return None
+
+    return _parse_comment_header(body[:body.find('-->') + 3])
 
 
 def _parse_comment_header(comment_header: Optional[str]) -> dict[str, str]:
@@ -151,66 +374,206 @@ def _parse_comment_header(comment_header: Optional[str]) -> dict[str, str]:
     return {}
 
 
-def _from_api_payload(comment: dict[str, Any]) -> Optional[TerraformComment]:
+def _find_details_open(body: str, pos: int) -> Tuple[int, int]:
+    """
+    Find the next `<details>` or `<details open>` tag at or after pos
+
+    Returns the start and end position of the tag, or (-1, -1) if there isn't one.
+    """
+
+    while (start := body.find('<details', pos)) != -1:
+        end = start + len('<details')
+
+        if body.startswith('>', end):
+            return start, end + 1
+        if end < len(body) and body[end].isspace() and body.startswith('open>', end + 1):
+            return start, end + len(' open>')
+
+        pos = end
+
+    return -1, -1
+
+
+def _skip_whitespace(body: str, pos: int) -> int:
+    while pos < len(body) and body[pos].isspace():
+        pos += 1
+    return pos
 
-    sections = []
 
-    for section_match in re.finditer(r'''
-        <details(?:\sopen)?>\s*
-        (?:<summary>(?P<summary>.*?)</summary>\s*)?
-        ```(?:hcl)?
-        (?P<body>.*?)
-        ```\s*
+def _parse_section(body: str, pos: int) -> Tuple[Optional[dict], int]:
+    """
+    Parse a section that starts just after a details tag at pos
+
+    A section is formatted as:
+
+        <details>
+        <summary>summary</summary>
+
+        ```hcl
+        body
+        ```
         </details>
-    ''', comment['body'], re.VERBOSE | re.DOTALL):
-        section = {
-            'summary': section_match.group('summary').strip() if 'summary' in section_match.groupdict() else None,
-            'body': section_match.group('body').strip()
-        }
-        sections.append(section)
-
-    match = re.match(r'''
-            (?P<headers><!--.*?-->\n)?
-            (?P<description>.*?)(?=<details>)
-            <details>.*</details>(?P<status>[\s\S]*)$
-        ''', comment['body'], re.VERBOSE | re.DOTALL)
-    
-    if not match:
+
+    The summary and the hcl language are optional.
+    Returns the section, or None if this isn't a section, and the position to continue parsing from.
+    """
+
+    pos = _skip_whitespace(body, pos)
+
+    summary = None
+    if body.startswith('<summary>', pos):
+        summary_end = body.find('</summary>', pos)
+        if summary_end == -1:
+            return None, pos
+
+        summary = body[pos + len('<summary>'):summary_end].strip()
+        pos = _skip_whitespace(body, summary_end + len('</summary>'))
+
+    if not body.startswith('```', pos):
+        return None, pos
+    pos += 3
+
+    if body.startswith('hcl', pos):
+        pos += 3
+
+    # The body ends at the first fence that is followed by the closing details tag
+    search = pos
+    while (fence := body.find('```', search)) != -1:
+        after_fence = _skip_whitespace(body, fence + 3)
+        if body.startswith('</details>', after_fence):
+            return {'summary': summary, 'body': body[pos:fence].strip()}, after_fence + len('</details>')
+        search = fence + 1
+
+    # There are no more complete sections in the body
+    return None, len(body)
+
+
+def _from_api_payload(comment: dict[str, Any]) -> Optional[TerraformComment]:
+    """
+    Parse a comment from the GitHub API into a TerraformComment
+
+    The body is parsed in a single pass: the optional header, the description up to the first details tag,
+    the details sections, and the status after the last closing details tag.
+    Returns None if the comment doesn't have any details tags.
+    """
+
+    body = comment['body']
+
+    last_details_close = body.rfind('</details>')
+
+    header, pos = _split_header(body)
+    details_start, details_end = _find_details_open(body, pos)
+
+    if header is not None and (details_start == -1 or last_details_close < details_end):
+        # The sections can only be found by including what looked like the header in the description
+        header, pos = None, 0
+        details_start, details_end = _find_details_open(body, pos)
+
+    if details_start == -1 or last_details_close < details_end:
         return None
 
-    return TerraformComment(
+    description = body[pos:details_start]
+
+    sections = []
+    section_spans = []
+    while details_start != -1:
+        section, pos = _parse_section(body, details_end)
+        if section is not None:
+            sections.append(section)
+            section_spans.append((details_start, pos))
+
+        details_start, details_end = _find_details_open(body, pos)
+
+    terraform_comment = TerraformComment(
         issue_url=comment['issue_url'],
         comment_url=comment['url'],
-        headers=_parse_comment_header(match.group('headers')),
-        description=match.group('description').strip(),
+        headers=_parse_comment_header(header),
+        description=description.strip(),
         sections=sections,
-        status=match.group('status').strip()
+        status=body[last_details_close + len('</details>'):].strip()
     )
+    terraform_comment._body = body
+    terraform_comment._section_spans = section_spans
 
+    return terraform_comment
 
-def _to_api_payload(comment: TerraformComment) -> str:
-    details_open = False
-    hcl_highlighting = False
 
-    header = _format_comment_header(**comment.headers)
+def _parsed_layout(comment: TerraformComment, parts: List[TerraformComment]) -> Optional[List[_ShardLayout]]:
+    """
+    The layout of a comment parsed from the GitHub API, so unchanged sections don't need to be rendered again
 
-    body = f'''{header}
-{comment.description}
-'''
-    
-    for section in comment.sections:
-        section_summary = section.get('summary')
-        section_body = section.get('body')
+    parts are the parsed GitHub comments of the comment, in order.
+    The layout is only used if rendering the comment with it gives the same digest as each GitHub comment has.
+    This renders every part, so it is only done for the comment that was found, when its layout is first needed.
+    """
+
+    if any(part.headers.get('digest') is None for part in parts):
+        return None
+
+    layout = []
+    for part in parts:
+        section_digests = {h.get('plan_name'): h.get('section_digest') for h in part.headers.get('plan_hashes') or []}
+        layout.append(_ShardLayout(
+            [f'\n{part._body[start:end]}\n' for start, end in part._section_spans],
+            part.headers.get('plan_hashes'),
+            [section_digests.get(_section_plan_name(section)) for section in part.sections]
+        ))
 
-        if section_body.startswith('Error'):
-            details_open = True
-        elif 'Plan:' in section.get('body'):
-            hcl_highlighting = True
+    for shard, part in enumerate(parts):
+        digest, _ = _render_shard(comment, layout, shard)
+        if digest != part.headers['digest']:
+            debug(f'Comment {part.comment_url} has been changed, it will be rendered again')
+            return None
 
-        if section_summary is None:
-            details_open = True
+    return layout
 
-        body += f'''
+
+def format_plan_text(plan_text: str, max_body_size: int = 50000) -> Tuple[str, str]:
+    """
+    Format the given plan for insertion into a PR comment
+    """
+
+    def truncate(t):
+        lines = []
+        total_size = 0
+
+        for line in t.splitlines():
+            line_size = len(line.encode()) + 1  # + newline
+            if total_size + line_size > max_body_size:
+                lines.append('Plan is too large to fit in a PR comment. See the full plan in the workflow log.')
+                break
+
+            lines.append(line)
+            total_size += line_size
+
+        return '\n'.join(lines)
+
+    if len(plan_text.encode()) > max_body_size:
+        # needs truncation
+        return 'trunc', truncate(plan_text)
+    else:
+        return 'text', plan_text
+
+
+def _format_section(section: dict, max_size: Optional[int] = None) -> str:
+    """
+    Render a section of a comment
+
+    If max_size is given, the plan text is truncated so the rendered section is at most max_size bytes.
+    """
+
+    section_summary = section.get('summary')
+    section_body = section.get('body').strip()
+
+    if max_size is not None:
+        overhead = len(_format_section({'summary': section_summary, 'body': ''}).encode())
+        # Leave room for the truncation message
+        _, section_body = format_plan_text(section_body, max_size - overhead - 100)
+
+    details_open = section_body.startswith('Error') or section_summary is None
+    hcl_highlighting = 'Plan:' in section_body
+
+    return f'''
 <details{' open' if details_open else ''}>
 {f'<summary>{section_summary}</summary>' if section_summary is not None else ''}
 
@@ -220,12 +583,189 @@ def _to_api_payload(comment: TerraformComment) -> str:
 </details>
 '''
 
-    if comment.status:
-        body += '\n' + comment.status
+
+def _section_plan_name(section: dict) -> Optional[str]:
+    """
+    The plan name of the module a section is for
+
+    Section summaries start with the module path, and plan names are the module path with '/' replaced by '___'
+    """
+
+    summary = section.get('summary')
+    if not summary or ': ' not in summary:
+        return None
+
+    return summary.split(': ', 1)[0].replace('/', '___')
+
+
+def _continuation_description(comment: TerraformComment, shard: int) -> str:
+    return f'{comment.description}\n\n_Continued, part {shard + 1}_'
+
+
+def _shard_headers(comment: TerraformComment, shard: int, shard_count: int, plan_hashes: Optional[List[dict]]) -> dict[str, Any]:
+    if shard == 0:
+        headers = {k: v for k, v in comment.headers.items() if k not in ['shards', 'digest']}
+        if shard_count > 1:
+            headers['shards'] = shard_count
+    else:
+        headers = {k: v for k, v in comment.headers.items() if k not in _primary_only_headers + ['digest']}
+        headers['shard'] = shard
+
+    if plan_hashes is not None:
+        headers['plan_hashes'] = plan_hashes
+
+    return headers
+
+
+def _format_body(description: str, sections: List[str], status: str) -> str:
+    body = f'\n{description}\n' + ''.join(sections)
+
+    if status:
+        body += '\n' + status
 
     return body
 
 
+def _format_payload(headers: dict[str, Any], description: str, sections: List[str], status: str) -> str:
+    return _format_comment_header(**headers) + _format_body(description, sections, status)
+
+
+def _format_digested_payload(headers: dict[str, Any], description: str, sections: List[str], status: str) -> Tuple[str, str]:
+    """
+    Render a comment body with a digest header
+
+    The digest covers everything in the body except the digest itself and the _undigested_headers.
+    Returns a tuple of (digest, body)
+    """
+
+    body = _format_body(description, sections, status)
+
+    digest = hashlib.sha256(_format_comment_header(**{k: v for k, v in headers.items() if k not in _undigested_headers}).encode())
+    digest.update(body.encode())
+
+    return digest.hexdigest(), _format_comment_header(**(headers | {'digest': digest.hexdigest()})) + body
+
+
+def _section_digest(section: dict) -> str:
+    return hashlib.sha256(f'{section.get("summary") or ""}\0{section.get("body").strip()}'.encode()).hexdigest()[:16]
+
+
+def _pack_sections(comment: TerraformComment, previous: Optional[List[_ShardLayout]] = None) -> List[_ShardLayout]:
+    """
+    Render the sections of a comment and pack them into one or more GitHub comments
+
+    Sections are packed in order into comments of at most max_comment_size bytes, in one pass.
+    Each section's plan hash goes in the header of the comment the section is in, with the section digest.
+    The first comment also has the description, status and any plan hashes that don't belong to a section.
+
+    If the previous layout of the comment is given, sections that have the same digest as before are not rendered
+    again. A section that started a later comment before starts a new comment again. This keeps the comments after a
+    changed section the same where possible, so they don't need to be updated.
+    """
+
+    sections = comment.sections if isinstance(comment.sections, list) else []
+    plan_hashes = comment.headers.get('plan_hashes')
+    has_plan_hashes = plan_hashes is not None
+
+    unassigned = {id(h): h for h in plan_hashes or []}
+    hashes_by_name = {h.get('plan_name'): h for h in plan_hashes or []}
+
+    def entry_size(entry: dict) -> int:
+        return len(_compact_json.encode(entry).encode()) + 1
+
+    section_hashes = []
+    for section in sections:
+        entry = hashes_by_name.get(_section_plan_name(section))
+        if entry is not None and id(entry) in unassigned:
+            del unassigned[id(entry)]
+            section_hashes.append(entry)
+        else:
+            section_hashes.append(None)
+
+    leftover_hashes = list(unassigned.values())
+
+    primary_overhead = _digest_header_size + len(_format_payload(
+        _shard_headers(comment, 0, 2, leftover_hashes if has_plan_hashes else None), comment.description, [], comment.status
+    ).encode())
+    continuation_overhead = _digest_header_size + len(_format_payload(
+        _shard_headers(comment, len(sections) + 1, 0, [] if has_plan_hashes else None), _continuation_description(comment, len(sections) + 1), [], ''
+    ).encode())
+
+    # Any single section must fit in a comment on its own
+    max_section_size = max_comment_size - max(primary_overhead, continuation_overhead)
+
+    previous_sections = {}
+    for previous_shard, shard_layout in enumerate(previous or []):
+        for index, (digest, text) in enumerate(zip(shard_layout.digests, shard_layout.sections)):
+            if digest is not None:
+                previous_sections.setdefault(digest, (previous_shard if index == 0 else None, text))
+
+    shards: List[Tuple[List[str], List[dict], List[Optional[str]]]] = [([], leftover_hashes, [])]
+    used = primary_overhead
+
+    for section, entry in zip(sections, section_hashes):
+        digest = _section_digest(section)
+
+        size = 0
+        if entry is not None:
+            # The plan_hashes in the comment headers are not changed
+            entry = {**entry, 'section_digest': digest}
+            size = entry_size(entry)
+
+        # previous_shard is set if the section started a comment before
+        previous_shard, text = previous_sections.get(digest, (None, None))
+        text_size = len(text.encode()) if text is not None else 0
+        if text is None or size + text_size > max_section_size:
+            previous_shard = None
+            text = _format_section(section)
+            text_size = len(text.encode())
+            if size + text_size > max_section_size:
+                text = _format_section(section, max_section_size - size)
+                text_size = len(text.encode())
+        size += text_size
+
+        if shards[-1][0] and (used + size > max_comment_size or (previous_shard is not None and previous_shard >= len(shards))):
+            shards.append(([], [], []))
+            used = continuation_overhead
+
+        shards[-1][0].append(text)
+        shards[-1][2].append(digest)
+        if entry is not None:
+            shards[-1][1].append(entry)
+        used += size
+
+    return [
+        _ShardLayout(shard_sections, shard_hashes if has_plan_hashes else None, digests)
+        for shard_sections, shard_hashes, digests in shards
+    ]
+
+
+def _render_shard(comment: TerraformComment, layout: List[_ShardLayout], shard: int) -> Tuple[str, str]:
+    """
+    Render the body of one of the GitHub comments of a comment
+
+    Returns a tuple of (digest, body)
+    """
+
+    headers = _shard_headers(comment, shard, len(layout), layout[shard].plan_hashes)
+
+    if shard == 0:
+        return _format_digested_payload(headers, comment.description, layout[shard].sections, comment.status)
+    else:
+        return _format_digested_payload(headers, _continuation_description(comment, shard), layout[shard].sections, '')
+
+
+def _to_api_payloads(comment: TerraformComment) -> List[Tuple[str, str]]:
+    """
+    Render a comment as the bodies of one or more GitHub comments
+
+    Returns a list of (digest, body) tuples, one for each comment
+    """
+
+    layout = _pack_sections(comment)
+    return [_render_shard(comment, layout, shard) for shard in range(len(layout))]
+
+
 def matching_headers(comment: TerraformComment, headers: dict[str, str]) -> bool:
     """
     Does a comment have all the specified headers
@@ -234,23 +774,115 @@ def matching_headers(comment: TerraformComment, headers: dict[str, str]) -> bool
     If a header should NOT be present in the comment, specify a header with a value of None
     """
 
+    return _headers_match(comment.headers, headers)
+
+
+def _headers_match(comment_headers: dict[str, Any], headers: dict[str, str]) -> bool:
     for header, value in headers.items():
-        if value is None and header in comment.headers:
+        if value is None and header in comment_headers:
             return False
 
-        if value is not None and comment.headers.get(header) != value:
+        if value is not None and comment_headers.get(header) != value:
             return False
 
     return True
 
 
-def find_comment(github: GithubApi, issue_url: IssueUrl, username: str, headers: dict[str, str], backup_headers: dict[str, str], legacy_description: str) -> TerraformComment:
+def _merge_shards(comment: TerraformComment, continuations: dict[int, TerraformComment]) -> TerraformComment:
+    """
+    Combine the first comment of a sharded comment with its continuation comments
+    """
+
+    sections = list(comment.sections)
+    plan_hashes = list(comment.headers.get('plan_hashes') or [])
+    shards = []
+
+    for shard in range(1, int(comment.headers.get('shards', 1))):
+        if continuation := continuations.get(shard):
+            sections.extend(continuation.sections)
+            plan_hashes.extend(continuation.headers.get('plan_hashes') or [])
+            shards.append({'url': continuation.comment_url, 'digest': continuation.headers.get('digest')})
+        else:
+            debug(f'Continuation comment {shard} is missing')
+            shards.append({'url': None, 'digest': None})
+
+    headers = comment.headers.copy()
+    if 'plan_hashes' in headers:
+        headers['plan_hashes'] = plan_hashes
+
+    merged = TerraformComment(
+        issue_url=comment.issue_url,
+        comment_url=comment.comment_url,
+        headers=headers,
+        description=comment.description,
+        sections=sections,
+        status=comment.status,
+        shards=shards
+    )
+
+    if all(shard['url'] is not None for shard in shards):
+        merged._parsed_parts = [comment] + [continuations[shard] for shard in range(1, len(shards) + 1)]
+
+    return merged
+
+
+def _has_all_shards(comment: TerraformComment, continuations: dict[int, TerraformComment]) -> bool:
+    return all(shard in continuations for shard in range(1, int(comment.headers.get('shards', 1))))
+
+
+def _comment_cache_key(issue_url: IssueUrl, username: str, headers: dict[str, str]) -> str:
+    key = json.dumps({'issue_url': issue_url, 'username': username, 'headers': headers}, sort_keys=True)
+    return f'comment-url/{hashlib.sha256(key.encode()).hexdigest()}'
+
+
+def _get_comment(github: GithubApi, comment_url: CommentUrl, username: str) -> Optional[TerraformComment]:
+    response = github.get(comment_url)
+    if not response.ok:
+        return None
+
+    comment_payload = response.json()
+    if comment_payload['user']['login'] != username:
+        return None
+
+    return _from_api_payload(comment_payload)
+
+
+def _find_cached_comment(github: GithubApi, cached: dict[str, Any], username: str, headers: dict[str, str]) -> Optional[TerraformComment]:
+    """
+    Get a previously found comment by url, checking it still matches the headers
+    """
+
+    comment = _get_comment(github, cached['comment_url'], username)
+    if comment is None or 'shard' in comment.headers or not matching_headers(comment, headers):
+        return None
+
+    continuations = {}
+    for shard_url in cached.get('shards', []):
+        continuation = _get_comment(github, shard_url, username)
+        if continuation is None or 'shard' not in continuation.headers or not matching_headers(continuation, headers):
+            return None
+        continuations[int(continuation.headers['shard'])] = continuation
+
+    if not _has_all_shards(comment, continuations):
+        return None
+
+    return _merge_shards(comment, continuations)
+
+
+def find_comment(github: GithubApi, issue_url: IssueUrl, username: str, headers: dict[str, str], backup_headers: dict[str, str], legacy_description: str, cache: Optional[ActionsCache] = None) -> TerraformComment:
     """
     Find a github comment that matches the given headers
 
     If no comment is found with the specified headers, tries to find a comment that matches the specified description instead.
     This is in case the comment was made with an earlier version, where comments were matched by description only.
 
+    If the matching comment is sharded, the continuation comments with the same headers are found and combined with it.
+
+    Comments are searched newest first. The header of each comment is checked before the rest of the comment is parsed.
+    If a cache is given, the url of the comment that matches the headers is stored in it. Later searches fetch that
+    comment directly, and only list the comments if it no longer matches.
+    Pages of comments are fetched as they are searched, so the search stops fetching once it has found the comment.
+
     If not existing comment is found a new TerraformComment object is returned which represents a PR comment yet to be created.
 
     :param github: The github api object to make requests with
@@ -258,31 +890,70 @@ def find_comment(github: GithubApi, issue_url: IssueUrl, username: str, headers:
     :param username: The user who made the comment
     :param headers: The headers that must be present on the comment
     :param legacy_description: The description that must be present on the comment, if not headers are found.
+    :param cache: A cache to store the url of the matching comment in
     """
 
     debug(f"Searching for comment with {headers=}")
     debug(f"Or backup headers {backup_headers=}")
 
+    cache_key = _comment_cache_key(issue_url, username, headers)
+
+    if cache is not None and cache_key in cache:
+        if comment := _find_cached_comment(github, json.loads(cache[cache_key]), username, headers):
+            debug(f'Found cached comment that matches headers {comment.headers=}')
+            return comment
+
+        debug('Cached comment no longer matches')
+
+    def found(comment: TerraformComment) -> TerraformComment:
+        if cache is not None:
+            cache[cache_key] = json.dumps({
+                'comment_url': comment.comment_url,
+                'shards': [shard['url'] for shard in comment.shards if shard['url'] is not None]
+            })
+
+        return comment
+
+    matched_comment = None
     backup_comment = None
     legacy_comment = None
 
-    for comment_payload in github.paged_get(issue_url + '/comments'):
+    continuations = {}
+    backup_continuations = {}
+
+    for comment_payload in github.paged_get_reverse(issue_url + '/comments', params={'per_page': 100}):
 
         if comment_payload['user']['login'] != username:
             continue
 
+        header = _parse_header_line(comment_payload['body'])
+        if header and not (_headers_match(header, headers) or _headers_match(header, backup_headers)):
+            debug(f"Didn't match comment with {header=}")
+            continue
+
         if comment := _from_api_payload(comment_payload):
 
-            if comment.headers:
-                # Match by headers only
+            if 'shard' in comment.headers:
+                # A continuation of a sharded comment
 
                 if matching_headers(comment, headers):
-                    debug(f'Found comment that matches headers {comment.headers=} ')
-                    return comment
+                    debug(f'Found continuation comment that matches headers {comment.headers=}')
+                    continuations.setdefault(int(comment.headers['shard']), comment)
+                elif matching_headers(comment, backup_headers):
+                    backup_continuations.setdefault(int(comment.headers['shard']), comment)
 
-                if matching_headers(comment, backup_headers):
-                    debug(f'Found comment that matches backup headers {comment.headers=} ')
-                    backup_comment = comment
+            elif comment.headers:
+                # Match by headers only
+
+                if matching_headers(comment, headers):
+                    if matched_comment is None:
+                        debug(f'Found comment that matches headers {comment.headers=} ')
+                        matched_comment = comment
+
+                elif matching_headers(comment, backup_headers):
+                    if backup_comment is None:
+                        debug(f'Found comment that matches backup headers {comment.headers=} ')
+                        backup_comment = comment
                 else:
                     debug(f"Didn't match comment with {comment.headers=}")
 
@@ -295,9 +966,17 @@ def find_comment(github: GithubApi, issue_url: IssueUrl, username: str, headers:
                 else:
                     debug(f"Didn't match comment with {comment.description=}")
 
+        if matched_comment is not None and _has_all_shards(matched_comment, continuations):
+            return found(_merge_shards(matched_comment, continuations))
+
+    if matched_comment is not None:
+        return found(_merge_shards(matched_comment, continuations))
+
     if backup_comment is not None:
         debug('Using comment matching backup headers')
 
+        backup_comment = _merge_shards(backup_comment, backup_continuations)
+
         # Use the backup comment but update the headers
         return TerraformComment(
             issue_url=backup_comment.issue_url,
@@ -305,7 +984,8 @@ def find_comment(github: GithubApi, issue_url: IssueUrl, username: str, headers:
             headers=backup_comment.headers | headers,
             description=backup_comment.description,
             sections=backup_comment.sections,
-            status=backup_comment.status
+            status=backup_comment.status,
+            shards=backup_comment.shards
         )
 
     if legacy_comment is not None:
@@ -342,7 +1022,10 @@ def update_comment(
     status: str = None
 ) -> TerraformComment:
 
-    new_headers = headers if headers is not None else comment.headers
+    previous_digest = comment.headers.get('digest')
+    previous_layout = comment._layout
+
+    new_headers = dict(headers if headers is not None else comment.headers)
     new_headers['version'] = version
 
     new_comment = TerraformComment(
@@ -350,16 +1033,73 @@ def update_comment(
         comment_url=comment.comment_url,
         headers=new_headers,
         description=description if description is not None else comment.description,
-        sections=sections if sections is not None else comment.sections,
+        sections=sections if sections is not None else comment._sections,
         status=status if status is not None else comment.status
     )
 
+    layout = None
+    if (
+        headers is None and description is None and sections is None and previous_layout is not None
+        and len(comment.shards) == len(previous_layout) - 1 and all(shard['url'] is not None for shard in comment.shards)
+    ):
+        # Only the status can have changed, which is only in the first comment. The first comment is rendered from
+        # its stored sections, and the continuation comments are unchanged, so the other sections aren't decoded.
+        digest, payload = _render_shard(new_comment, previous_layout, 0)
+        if len(payload.encode()) <= max_comment_size:
+            layout = previous_layout
+            payloads = [(digest, payload)] + [(shard['digest'], None) for shard in comment.shards]
+
+    if layout is None:
+        layout = _pack_sections(new_comment, previous_layout)
+        payloads = [_render_shard(new_comment, layout, shard) for shard in range(len(layout))]
+
+    digest, payload = payloads[0]
+    new_headers['digest'] = digest
+
     if comment.comment_url is not None:
-        response = github.patch(comment.comment_url, json={'body': _to_api_payload(new_comment)})
-        response.raise_for_status()
+        comment_url = comment.comment_url
+
+        if digest == previous_digest:
+            debug('Comment is unchanged')
+        else:
+            response = github.patch(comment.comment_url, json={'body': payload})
+            response.raise_for_status()
     else:
-        response = github.post(comment.issue_url + '/comments', json={'body': _to_api_payload(new_comment)})
+        response = github.post(comment.issue_url + '/comments', json={'body': payload})
         response.raise_for_status()
-        new_comment.comment_url = response.json()['url']
+        comment_url = response.json()['url']
+
+    shards = []
+    for shard, (digest, payload) in enumerate(payloads[1:], start=1):
+        previous = comment.shards[shard - 1] if shard <= len(comment.shards) else {'url': None, 'digest': None}
+        shard_url = previous['url']
+
+        if shard_url is None:
+            response = github.post(comment.issue_url + '/comments', json={'body': payload})
+            response.raise_for_status()
+            shard_url = response.json()['url']
+        elif previous.get('digest') == digest:
+            debug(f'Continuation comment {shard} is unchanged')
+        else:
+            response = github.patch(shard_url, json={'body': payload})
+            response.raise_for_status()
+
+        shards.append({'url': shard_url, 'digest': digest})
+
+    for shard in comment.shards[len(payloads) - 1:]:
+        if shard['url'] is not None:
+            debug(f'Deleting continuation comment {shard["url"]} that is no longer needed')
+            github.delete(shard['url'])
+
+    updated_comment = TerraformComment(
+        issue_url=new_comment.issue_url,
+        comment_url=comment_url,
+        headers=new_comment.headers,
+        description=new_comment.description,
+        sections=new_comment._sections,
+        status=new_comment.status,
+        shards=shards
+    )
+    updated_comment._layout = layout
 
-    return new_comment
+    return updated_comment
@@ -1,7 +1,13 @@
 import hashlib
+import io
+import json
+from pathlib import Path
+
+import canonicaljson
 
 from github_actions.debug import debug
-from github_pr_comment.cmp import remove_warnings, remove_unchanged_attributes
+from github_pr_comment.plan_json import iter_changes
+from terraform.plan_hash import plan_lines_hash
 
 
 def comment_hash(value: bytes, salt: str) -> str:
@@ -14,12 +20,54 @@ def plan_hash(plan_text: str, salt: str) -> str:
     """
     Compute a hash of the plan
 
-    This currently uses the plan text output.
-    TODO: Change to use the plan json output
+    This uses the plan text output.
+    See plan_json_hash for a hash of the plan json output.
+    """
+
+    return plan_lines_hash(io.StringIO(plan_text), salt)
+
+
+def plan_file_hash(path: Path, salt: str) -> str:
+    """
+    Compute a hash of the plan text in a file, without reading the whole file into memory
+
+    This is the same as plan_hash of the stripped file content.
+    """
+
+    with open(path) as f:
+        return plan_lines_hash(f, salt, strip=True)
+
+
+def plan_json_hash(plan_json_path: Path, salt: str) -> str:
+    """
+    Compute a hash of the plan from the `terraform show -json` output
+
+    Only the resource_changes and output_changes are hashed, and changes with no actions other than no-op are
+    ignored. Each change is digested in canonical json form, and the digests are hashed in order of resource
+    address and output name, so the result doesn't depend on the order terraform lists the changes in.
+
+    The plan file is scanned without loading the whole document.
     """
 
-    debug(f'Hashing with salt {salt}')
+    debug(f'Hashing {plan_json_path} with salt {salt}')
+
+    resources = []
+    outputs = []
+
+    for kind, name, raw in iter_changes(plan_json_path):
+        change = json.loads(raw)
+
+        if change.get('change', change).get('actions') == ['no-op']:
+            continue
+
+        digest = hashlib.sha256(canonicaljson.encode_canonical_json(change)).hexdigest()
 
-    plan = remove_warnings(remove_unchanged_attributes(plan_text))
+        if kind == 'resource':
+            resources.append((change.get('address', ''), str(change.get('deposed', '')), digest))
+        else:
+            outputs.append((name, digest))
 
-    return comment_hash(plan.encode(), salt)
+    return comment_hash(canonicaljson.encode_canonical_json({
+        'resource_changes': sorted(resources),
+        'output_changes': sorted(outputs)
+    }), salt)
@@ -0,0 +1,195 @@
+"""
+Reading the plan files in PLAN_OUT_DIR
+
+Each plan file is read once, producing everything the PR comment needs from it: the section summary and body,
+the plan hash and the number of changes.
+
+The approved subcommand keeps everything except the body in a compact index in the step cache, so running it again
+in the same step doesn't read and hash the plan files again. The index is not visible to other steps, and the apply
+step generates new plan files anyway, so the first run in a step always reads every plan file.
+Index entries are only reused if the plan file has the same size and modification time.
+"""
+
+import io
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+from github_actions.cache import ActionsCache
+from github_actions.debug import debug
+from github_pr_comment.hash import plan_lines_hash, plan_json_hash
+from github_pr_comment.plan_json import PlanJsonError
+from plan_renderer.summary import PlanSummary
+from terraform.exec import PLAN_SUMMARY_NAME
+
+_INDEX_KEY = 'plan-index'
+_INDEX_VERSION = 1
+
+
+class PlanFile(NamedTuple):
+    """What is known about a plan file in PLAN_OUT_DIR"""
+    name: str
+    size: int
+    mtime_ns: int
+    summary: str
+    plan_hash: Optional[str]
+    add: int = 0
+    change: int = 0
+    destroy: int = 0
+    move: int = 0
+    error: bool = False
+
+    @property
+    def module_path(self) -> str:
+        return self.name.replace('___', '/')
+
+
+def plan_file_names(folder_path: str) -> List[str]:
+    """The names of the plan files in folder_path, in the order they are shown in the PR comment"""
+
+    return sorted(
+        name for name in os.listdir(folder_path)
+        if name != PLAN_SUMMARY_NAME and os.path.isfile(os.path.join(folder_path, name))
+    )
+
+
+def hash_json_plan(name: str, salt: str, plan_json_dir: Path) -> Optional[str]:
+    """
+    Hash the JSON plan for a module, which must exist in plan_json_dir
+    """
+
+    try:
+        return plan_json_hash(Path(plan_json_dir, f'{name}.json'), salt)
+    except (OSError, PlanJsonError) as e:
+        debug(f'Unable to hash JSON plan for {name}: {e}')
+        return None
+
+
+def ingest_plan(folder_path: str, name: str, salt: Optional[str], plan_hash_format: str, plan_json_dir: Path, keep_body: bool = True) -> Tuple[PlanFile, Optional[str]]:
+    """
+    Read a plan file
+
+    The summary and the hash of the plan text are found in the same pass over the file.
+    If salt is None the plan is not hashed.
+    If keep_body is False the plan text isn't kept, so only a line at a time is held in memory.
+    Returns the PlanFile and the plan text.
+    """
+
+    path = os.path.join(folder_path, name)
+    stat = os.stat(path)
+
+    summary = PlanSummary(name.replace('___', '/'))
+    plan_text = None
+
+    with open(path) as f:
+        if keep_body:
+            plan_text = f.read()
+            lines = summary.lines(io.StringIO(plan_text))
+        else:
+            lines = summary.lines(f)
+
+        plan_hash = None
+        if salt is not None and plan_hash_format != 'json':
+            plan_hash = plan_lines_hash(lines, salt, strip=True)
+
+        # Hashing stops at any warnings after the plan, but the summary needs every line
+        for _ in lines:
+            pass
+
+    if salt is not None and plan_hash_format == 'json':
+        plan_hash = hash_json_plan(name, salt, plan_json_dir)
+
+    return PlanFile(
+        name=name,
+        size=stat.st_size,
+        mtime_ns=stat.st_mtime_ns,
+        summary=summary.summary,
+        plan_hash=plan_hash,
+        **summary.counts
+    ), plan_text
+
+
+def _ingest_plan_file(args: Tuple[str, str, str, str, Path]) -> PlanFile:
+    plan, _ = ingest_plan(*args, keep_body=False)
+    return plan
+
+
+def ingest_plans(folder_path: str, salt: Optional[str], plan_hash_format: str, plan_json_dir: Path) -> Iterable[Tuple[PlanFile, str]]:
+    """Read every plan file in folder_path"""
+
+    for name in plan_file_names(folder_path):
+        yield ingest_plan(folder_path, name, salt, plan_hash_format, plan_json_dir)
+
+
+def write_index(cache: ActionsCache, salt: str, plan_hash_format: str, plans: List[PlanFile]) -> None:
+    cache[_INDEX_KEY] = json.dumps({
+        'version': _INDEX_VERSION,
+        'salt': salt,
+        'plan_hash_format': plan_hash_format,
+        'plans': [list(plan) for plan in plans]
+    }, separators=(',', ':'))
+
+
+def read_index(cache: ActionsCache, salt: str, plan_hash_format: str) -> dict[str, PlanFile]:
+    """
+    Read the index of plan files written by an earlier run in the same step
+
+    Returns an empty index if there isn't one for the same salt and hash format.
+    """
+
+    try:
+        index = json.loads(cache[_INDEX_KEY])
+    except (IndexError, ValueError):
+        return {}
+
+    if index.get('version') != _INDEX_VERSION or index.get('salt') != salt or index.get('plan_hash_format') != plan_hash_format:
+        debug('Plan index is for a different plan')
+        return {}
+
+    return {plan[0]: PlanFile(*plan) for plan in index['plans']}
+
+
+def load_plans(folder_path: str, salt: str, plan_hash_format: str, plan_json_dir: Path, cache: ActionsCache, workers: Optional[int] = None) -> List[PlanFile]:
+    """
+    Get the PlanFile for every plan file in folder_path
+
+    Plan files that are in the index and haven't changed are not read again. The index is updated with any that were.
+    The plan files that do need to be read are hashed in a pool of worker processes.
+    """
+
+    index = read_index(cache, salt, plan_hash_format)
+
+    plans: dict[str, PlanFile] = {}
+    to_read = []
+
+    names = plan_file_names(folder_path)
+    for name in names:
+        stat = os.stat(os.path.join(folder_path, name))
+
+        if (plan := index.get(name)) and plan.size == stat.st_size and plan.mtime_ns == stat.st_mtime_ns:
+            plans[name] = plan
+        else:
+            to_read.append(name)
+
+    if to_read:
+        debug(f'Reading {len(to_read)} plan files')
+        args = [(folder_path, name, salt, plan_hash_format, plan_json_dir) for name in to_read]
+
+        if len(to_read) > 1 and workers != 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                chunksize = max(1, len(args) // (4 * (workers or os.cpu_count() or 1)))
+                read = list(executor.map(_ingest_plan_file, args, chunksize=chunksize))
+        else:
+            read = [_ingest_plan_file(arg) for arg in args]
+
+        for plan in read:
+            plans[plan.name] = plan
+
+    result = [plans[name] for name in names]
+
+    if to_read or len(result) != len(index):
+        write_index(cache, salt, plan_hash_format, result)
+
+    return result
@@ -0,0 +1,136 @@
+"""
+Streaming access to terraform JSON plans
+
+JSON plans for large configurations can be hundreds of MB, most of which is prior state and configuration.
+Rather than loading the whole document, the plan file is memory mapped and scanned for the top level
+`resource_changes` and `output_changes` members. Only the individual change objects are decoded.
+"""
+
+import json
+import mmap
+import re
+from pathlib import Path
+from typing import Iterable, Tuple
+
+_WHITESPACE = re.compile(rb'[ \t\r\n]*')
+_STRING = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+_STRUCTURAL = re.compile(rb'["{}\[\]]')
+_SCALAR = re.compile(rb'[^,}\]\s]+')
+
+
+class PlanJsonError(Exception):
+    """The JSON plan could not be scanned"""
+
+
+def _skip_whitespace(buf, pos: int) -> int:
+    return _WHITESPACE.match(buf, pos).end()
+
+
+def _expect(buf, pos: int, char: bytes) -> int:
+    pos = _skip_whitespace(buf, pos)
+    if buf[pos:pos + 1] != char:
+        raise PlanJsonError(f'Expected {char.decode()!r} at offset {pos}')
+    return pos + 1
+
+
+def _skip_string(buf, pos: int) -> int:
+    if match := _STRING.match(buf, pos):
+        return match.end()
+    raise PlanJsonError(f'Unterminated string at offset {pos}')
+
+
+def _skip_value(buf, pos: int) -> int:
+    """Return the offset just after the JSON value starting at pos"""
+
+    pos = _skip_whitespace(buf, pos)
+    char = buf[pos:pos + 1]
+
+    if char == b'"':
+        return _skip_string(buf, pos)
+
+    if char not in (b'{', b'['):
+        if match := _SCALAR.match(buf, pos):
+            return match.end()
+        raise PlanJsonError(f'Expected a value at offset {pos}')
+
+    depth = 0
+    while match := _STRUCTURAL.search(buf, pos):
+        char = match.group()
+        if char == b'"':
+            pos = _skip_string(buf, match.start())
+            continue
+
+        pos = match.end()
+        depth += 1 if char in (b'{', b'[') else -1
+        if depth == 0:
+            return pos
+
+    raise PlanJsonError('Unexpected end of plan')
+
+
+def _read_key(buf, pos: int) -> Tuple[bytes, int]:
+    pos = _skip_whitespace(buf, pos)
+    end = _skip_string(buf, pos)
+    return buf[pos + 1:end - 1], _expect(buf, end, b':')
+
+
+def _members(buf, pos: int) -> Iterable[Tuple[bytes, int, int]]:
+    """Yield the (key, start, end) of each member of the object starting at pos"""
+
+    pos = _expect(buf, pos, b'{')
+
+    if buf[_skip_whitespace(buf, pos):_skip_whitespace(buf, pos) + 1] == b'}':
+        return
+
+    while True:
+        key, start = _read_key(buf, pos)
+        end = _skip_value(buf, start)
+        yield key, _skip_whitespace(buf, start), end
+
+        pos = _skip_whitespace(buf, end)
+        if buf[pos:pos + 1] == b'}':
+            return
+        pos = _expect(buf, pos, b',')
+
+
+def _elements(buf, pos: int) -> Iterable[Tuple[int, int]]:
+    """Yield the (start, end) of each element of the array starting at pos"""
+
+    pos = _expect(buf, pos, b'[')
+
+    if buf[_skip_whitespace(buf, pos):_skip_whitespace(buf, pos) + 1] == b']':
+        return
+
+    while True:
+        start = _skip_whitespace(buf, pos)
+        end = _skip_value(buf, start)
+        yield start, end
+
+        pos = _skip_whitespace(buf, end)
+        if buf[pos:pos + 1] == b']':
+            return
+        pos = _expect(buf, pos, b',')
+
+
+def iter_changes(path: Path) -> Iterable[Tuple[str, str, bytes]]:
+    """
+    Yield the changes in a JSON plan file
+
+    Each item is a tuple of (kind, name, raw_json), where kind is 'resource' or 'output'.
+    For resource changes the name is empty; the raw JSON for each change must be decoded to identify it.
+    For output changes the name is the output name.
+    """
+
+    with open(path, 'rb') as f:
+        if not path.stat().st_size:
+            raise PlanJsonError(f'{path} is empty')
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            for key, start, end in _members(buf, 0):
+                if key == b'resource_changes':
+                    for element_start, element_end in _elements(buf, start):
+                        yield 'resource', '', buf[element_start:element_end]
+
+                elif key == b'output_changes':
+                    for name, value_start, value_end in _members(buf, start):
+                        yield 'output', json.loads(b'"' + name + b'"'), buf[value_start:value_end]
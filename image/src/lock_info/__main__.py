@@ -1,24 +1,42 @@
 """
 Create an actions output for any lock info
 
-Input arg is a path to a file containing stderr from a terraform command
+Input args are paths to files containing stderr from a terraform command, or directories of them.
 If any state lock info is found creates a `lock-info` actions output with a json dump of the lock info
 and has a zero exit code.
 
 If no state locked error is present, has a nonzero exit
 
+When given more than one path or a directory, the files are read in parallel and a json map of module to the lock
+info for that module is written to stdout. The module is the file name without its extension, with each '___'
+replaced by '/', as the stderr files for each module are named by the action scripts.
+The `lock-info` output is set to the lock info of the first locked module.
+
 Usage:
     lock-info <TERRAFORM_STDERR_PATH>
+    lock-info <TERRAFORM_STDERR_PATH|DIRECTORY>...
 """
 
 import json
+import os
 import re
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from typing import Iterable, Optional
 from github_actions.commands import output
+from terraform.run_all import stderr_paths
+
+_lock_info_field = re.compile(r'^\s+(?P<field>.*?):\s+(?P<value>.*)')
 
 
 def get_lock_info(stderr: Iterable[str]) -> Optional[dict[str, str]]:
+    """
+    Find the lock info of a state lock error
+
+    stderr can be a file that is read a line at a time. Every line is read, as the output can be from more than one
+    module, and if there is more than one lock info the fields of later ones replace those of earlier ones.
+    """
+
     locked = False
     lock_info_line = False
     lock_info = {}
@@ -26,8 +44,11 @@ def get_lock_info(stderr: Iterable[str]) -> Optional[dict[str, str]]:
     for line in stderr:
         if locked is True:
             if lock_info_line:
-                if match := re.match(r'^\s+(?P<field>.*?):\s+(?P<value>.*)', line):
+                if match := _lock_info_field.match(line):
                     lock_info[match['field']] = match['value']
+                elif lock_info:
+                    # The end of this lock info, keep going as there may be more for other modules
+                    lock_info_line = False
 
             elif line.startswith('Lock Info:'):
                 lock_info_line = True
@@ -38,14 +59,49 @@ def get_lock_info(stderr: Iterable[str]) -> Optional[dict[str, str]]:
     return lock_info if locked else None
 
 
+def read_lock_info(path: str) -> Optional[dict[str, str]]:
+    with open(path, errors='replace') as f:
+        return get_lock_info(f)
+
+
+def module_name(path: str) -> str:
+    return os.path.splitext(os.path.basename(path))[0].replace('___', '/')
+
+
+def batch_lock_info(paths: list[str]) -> dict[str, dict[str, str]]:
+    """
+    Find the lock info in many stderr files
+
+    Returns the lock info of each module that has a state lock error, in the same order as paths.
+    """
+
+    with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) + 4)) as executor:
+        results = executor.map(read_lock_info, paths)
+
+        return {
+            module_name(path): lock_info
+            for path, lock_info in zip(paths, results)
+            if lock_info is not None
+        }
+
+
 def main():
-    with open(sys.argv[1]) as f:
-        lock_info = get_lock_info(f.readlines())
+    if len(sys.argv) == 2 and not os.path.isdir(sys.argv[1]):
+        lock_info = read_lock_info(sys.argv[1])
+
+        if lock_info is None:
+            sys.exit(1)
+
+        output('lock-info', json.dumps(lock_info))
+        return
+
+    locks = batch_lock_info(stderr_paths(sys.argv[1:]))
+    sys.stdout.write(json.dumps(locks) + '\n')
 
-    if lock_info is None:
+    if not locks:
         sys.exit(1)
 
-    output('lock-info', json.dumps(lock_info))
+    output('lock-info', json.dumps(next(iter(locks.values()))))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,73 @@
+"""
+Summarising the text of a terraform plan
+"""
+
+import re
+from typing import Any, Iterable
+
+_moved = re.compile(r'  # \S+ has moved to \S+$')
+_change_counts = re.compile(r'(\d+) to (add|change|destroy|move)')
+
+
+class PlanSummary:
+    """
+    Finds the summary of the plan for a module, and the number of each kind of change, a line at a time
+    """
+
+    def __init__(self, module_path: str):
+        self._module_path = module_path
+        self._summary = None
+        self._to_move = 0
+        self._counts = {}
+
+
+    def lines(self, lines: Iterable[str]) -> Iterable[str]:
+        """Yield each line, after adding it to the summary"""
+
+        for line in lines:
+            self.add(line)
+            yield line
+
+
+    def add(self, line: str) -> None:
+        if line.startswith('No changes') or line.startswith('Error'):
+            self._summary = line
+
+        if _moved.match(line):
+            self._to_move += 1
+
+        if line.startswith('Plan:'):
+            self._summary = line
+            self._counts = {kind: int(count) for count, kind in _change_counts.findall(line)}
+            if self._to_move and 'move' not in self._summary:
+                self._summary = self._summary.rstrip('.') + f', {self._to_move} to move.'
+
+        if line.startswith('Changes to Outputs'):
+            if self._summary:
+                self._summary = self._summary + ' Changes to Outputs.'
+            else:
+                self._summary = line
+
+
+    @property
+    def summary(self) -> str:
+        return f'{self._module_path}: {self._summary}'
+
+
+    @property
+    def error(self) -> bool:
+        return self._summary is not None and self._summary.startswith('Error')
+
+
+    @property
+    def no_changes(self) -> bool:
+        return self._summary is not None and self._summary.startswith('No changes')
+
+
+    @property
+    def counts(self) -> dict[str, Any]:
+        return {
+            'move': self._to_move,
+            **self._counts,
+            'error': self.error
+        }
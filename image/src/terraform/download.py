@@ -4,20 +4,27 @@ Module for downloading terraform executables.
 
 from __future__ import annotations
 
+import hashlib
+import json
 import os.path
 import platform
+import shutil
 import subprocess
 import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import TYPE_CHECKING, Tuple
-from urllib.request import urlretrieve
+from typing import NamedTuple, Optional, Tuple
+from urllib.request import urlopen
 from urllib.error import HTTPError
 from zipfile import ZipFile
 
+from github_actions.cache import ActionsCache
 from github_actions.debug import debug
+from terraform.versions import Version
+
+_CHUNK_SIZE = 1024 * 1024
 
-if TYPE_CHECKING:
-    from terraform.versions import Version
 
 class DownloadError(Exception):
     """Error downloading terraform"""
@@ -57,45 +64,121 @@ def get_arch() -> str:
     raise Exception(f'Unknown arch {a}')
 
 
-def get_checksums(version: Version, checksum_dir: Path) -> Path:
+def _download(url: str, path: Path, description: str, not_found: Optional[str] = None) -> str:
+    """
+    Download a file, returning its SHA-256 digest
+
+    The digest is computed as the file is downloaded, so it doesn't need to be read again.
+    The file is downloaded to a temporary file and renamed into place, so a partial download is never used.
+    """
+
+    debug(f'Downloading {description} from {url}')
+    os.makedirs(path.parent, exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f'.{path.name}.')
+    try:
+        h = hashlib.sha256()
+        with os.fdopen(fd, 'wb') as f, urlopen(url) as response:
+            while chunk := response.read(_CHUNK_SIZE):
+                h.update(chunk)
+                f.write(chunk)
+
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+        return h.hexdigest()
+    except HTTPError as http_error:
+        Path(tmp_path).unlink(missing_ok=True)
+        if http_error.code == 404:
+            raise DownloadError(not_found or f'Could not download {description} - does this version exist?')
+        raise
+    except BaseException:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
+
+
+def _hash_file(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(_CHUNK_SIZE):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _file_identity(path: Path) -> list[int]:
+    """
+    Values that change when a file is modified
+
+    The change time can't be set by a user, so a file can't be modified without changing its identity.
+    """
+
+    stat = os.stat(path)
+    return [stat.st_ino, stat.st_size, stat.st_mtime_ns, stat.st_ctime_ns]
+
+
+def _digest_key(path: Path) -> str:
+    return f'sha256/{hashlib.sha256(str(Path(path).absolute()).encode()).hexdigest()}'
+
+
+def _store_digest(path: Path, digest: str, verified: Optional[ActionsCache]) -> None:
+    """
+    Remember the digest of a file in the verified cache
+
+    The digest is only used while the file is unchanged.
+    """
+
+    if verified is not None:
+        verified[_digest_key(path)] = json.dumps([*_file_identity(path), digest])
+
+
+def file_digest(path: Path, verified: Optional[ActionsCache] = None) -> str:
+    """
+    The SHA-256 digest of a file
+
+    A digest stored in the verified cache is used if the file hasn't changed since it was stored, otherwise the file
+    is hashed.
+    """
+
+    if verified is not None and _digest_key(path) in verified:
+        try:
+            stored = json.loads(verified[_digest_key(path)])
+            if stored[:-1] == _file_identity(path):
+                return stored[-1]
+        except (IndexError, ValueError):
+            pass
+
+    digest = _hash_file(path)
+    _store_digest(path, digest, verified)
+    return digest
+
+
+def get_checksums(version: Version, checksum_dir: Path, verified: Optional[ActionsCache] = None) -> Path:
     """
     Ensure we have the checksums in the checksum dir
 
-    Checksum files must have a valid signature file
+    Checksum files must have a valid signature file.
+    Once the signature has been verified the digests of both files are stored in the verified cache, and the
+    signature is not verified again unless the signature or checksums files change.
     """
 
     checksums_path = Path(checksum_dir, f'terraform_{version}_SHA256SUMS')
     signature_path = Path(checksum_dir, f'terraform_{version}_SHA256SUMS.72D7468F.sig')
+    verdict_key = f'gpg/terraform_{version}_SHA256SUMS'
 
     os.makedirs(checksum_dir, exist_ok=True)
 
     if not signature_path.exists():
         signature_url = f'https://releases.hashicorp.com/terraform/{version}/terraform_{version}_SHA256SUMS.72D7468F.sig'
-        debug(f'Downloading signature from {signature_url}')
-
-        try:
-            urlretrieve(
-                signature_url,
-                signature_path
-            )
-        except HTTPError as http_error:
-            if http_error.code == 404:
-                raise DownloadError(f'Could not download signature file for {version} - does this version exist?')
-            raise
+        _download(signature_url, signature_path, f'signature file for {version}')
 
     if not checksums_path.exists():
         checksum_url = f'https://releases.hashicorp.com/terraform/{version}/terraform_{version}_SHA256SUMS'
-        debug(f'Downloading checksums from {checksum_url}')
+        _download(checksum_url, checksums_path, f'checksums for {version}')
 
-        try:
-            urlretrieve(
-                checksum_url,
-                checksums_path
-            )
-        except HTTPError as http_error:
-            if http_error.code == 404:
-                raise DownloadError(f'Could not download checksums for {version} - does this version exist?')
-            raise
+    verdict = f'{_hash_file(signature_path)} {_hash_file(checksums_path)}'
+
+    if verified is not None and verdict_key in verified and verified[verdict_key] == verdict:
+        debug(f'Checksums signature for {version} already verified')
+        return checksums_path
 
     try:
         subprocess.run(
@@ -106,39 +189,50 @@ def get_checksums(version: Version, checksum_dir: Path) -> Path:
     except subprocess.CalledProcessError:
         raise DownloadError(f'Could not verify checksums signature for {version}')
 
+    if verified is not None:
+        verified[verdict_key] = verdict
+
     return checksums_path
 
 
-def download_archive(version: Version, cache_dir: Path) -> Tuple[Path, str]:
+def download_archive(version: Version, cache_dir: Path, verified: Optional[ActionsCache] = None) -> Tuple[Path, str]:
     """
     Download the zip file for the given version of terraform.
 
+    The digest of the downloaded archive is stored in the verified cache.
     The return value is the path to the zip file
     """
 
-    archive_path = Path(cache_dir, f'terraform_{version}_{get_platform()}_{get_arch()}.zip')
+    archive_name = f'terraform_{version}_{get_platform()}_{get_arch()}.zip'
+    archive_path = Path(cache_dir, archive_name)
 
     if os.path.exists(archive_path):
-        return cache_dir, f'terraform_{version}_{get_platform()}_{get_arch()}.zip'
+        return cache_dir, archive_name
 
-    archive_url = f'https://releases.hashicorp.com/terraform/{version}/terraform_{version}_{get_platform()}_{get_arch()}.zip'
-    debug(f'Downloading archive from {archive_url}')
-    os.makedirs(cache_dir, exist_ok=True)
+    archive_url = f'https://releases.hashicorp.com/terraform/{version}/{archive_name}'
+    digest = _download(
+        archive_url,
+        archive_path,
+        f'archive for {version}',
+        not_found=f'Could not download archive for {version} - does this version exist for this platform ({get_platform()}_{get_arch()})?'
+    )
+    _store_digest(archive_path, digest, verified)
 
-    try:
-        urlretrieve(
-            archive_url,
-            archive_path
-        )
-    except HTTPError as http_error:
-        if http_error.code == 404:
-            raise DownloadError(f'Could not download archive for {version} - does this version exist for this platform ({get_platform()}_{get_arch()})?')
-        raise
+    return cache_dir, archive_name
+
+
+def _expected_checksum(checksums_path: Path, name: str) -> Optional[str]:
+    """Find the checksum for a file named name in a SHA256SUMS file"""
+
+    for line in checksums_path.read_text().splitlines():
+        checksum, _, checksum_name = line.partition('  ')
+        if checksum_name == name:
+            return checksum
 
-    return cache_dir, f'terraform_{version}_{get_platform()}_{get_arch()}.zip'
+    return None
 
 
-def verify_archive(version: Version, cache_dir: Path, archive_name: str, checksum_dir: Path) -> None:
+def verify_archive(version: Version, cache_dir: Path, archive_name: str, checksum_dir: Path, verified: Optional[ActionsCache] = None) -> str:
     """
     Verify terraform zip archive
 
@@ -146,29 +240,22 @@ def verify_archive(version: Version, cache_dir: Path, archive_name: str, checksu
     :param cache_dir: The directory the archive is in
     :param archive_name: The name of the archive
     :param checksum_dir: The directory the checksum file can be found in
+    :param verified: A cache of the digests of files that have already been hashed
+    :returns: The SHA-256 digest of the archive
     """
 
-    def get_checksum():
-        """
-        Get the checksum for specified archive from the checksums file
-        """
-        for line in Path(checksum_dir, f'terraform_{version}_SHA256SUMS').read_bytes().splitlines():
-            if archive_name.encode() in line:
-                return line + b'\n'
+    checksum = _expected_checksum(Path(checksum_dir, f'terraform_{version}_SHA256SUMS'), archive_name)
+    if checksum is None:
         raise RuntimeError('Checksum not found')
 
-    try:
-        subprocess.run(
-            ['shasum', '--algorithm', '256', '--check', '--strict'],
-            check=True,
-            cwd=cache_dir,
-            input=get_checksum()
-        )
-    except subprocess.CalledProcessError:
+    digest = file_digest(Path(cache_dir, archive_name), verified)
+    if digest != checksum:
         raise DownloadError(f'Could not verify integrity of terraform executable for {version}')
 
+    return digest
 
-def get_archive(version: Version, cache_dirs: list[Path]) -> Tuple[Path, str]:
+
+def get_archive(version: Version, cache_dirs: list[Path], verified: Optional[ActionsCache] = None) -> Tuple[Path, str]:
     """
     Get the zip archive path for a terraform version
     """
@@ -181,10 +268,10 @@ def get_archive(version: Version, cache_dirs: list[Path]) -> Tuple[Path, str]:
         if archive_path.is_file():
             return cache_dir, f'terraform_{version}_{get_platform()}_{get_arch()}.zip'
 
-    return download_archive(version, cache_dir)
+    return download_archive(version, cache_dir, verified)
 
 
-def get_executable(version: Version) -> Path:
+def get_executable(version: Version, cache_dirs: Optional[list[Path]] = None, checksum_dir: Optional[Path] = None, executable_dir: Optional[Path] = None, verified: Optional[ActionsCache] = None) -> Path:
     """
     Get the path to the specified terraform executable.
 
@@ -197,25 +284,265 @@ def get_executable(version: Version) -> Path:
     If they are not found they will be downloaded to TERRAFORM_BIN_CHECKSUM_DIR.
 
     The default for both TERRAFORM_BIN_CACHE_DIR and TERRAFORM_BIN_CHECKSUM_DIR is .terraform-bin-dir in the current directory.
+    The executable is put in STEP_TEMP_DIR, copied from the executables extracted in TERRAFORM_BIN_CHECKSUM_DIR.
+    Each of these can be overridden with the arguments of the same name.
+
+    The signature verification and file digests are remembered in the verified cache, so files that haven't changed
+    are not verified again. This cache must be in a directory that only the action writes to. If it isn't given,
+    everything is verified on every call.
 
     The return value is the path to the executable
     """
 
-    cache_dirs = [Path(p) for p in os.environ.get('TERRAFORM_BIN_CACHE_DIR', '.terraform-bin-dir').split(':')]
-    checksum_dir = Path(os.environ.get('TERRAFORM_BIN_CHECKSUM_DIR', '.terraform-bin-dir'))
+    if cache_dirs is None:
+        cache_dirs = [Path(p) for p in os.environ.get('TERRAFORM_BIN_CACHE_DIR', '.terraform-bin-dir').split(':')]
+    if checksum_dir is None:
+        checksum_dir = Path(os.environ.get('TERRAFORM_BIN_CHECKSUM_DIR', '.terraform-bin-dir'))
 
-    get_checksums(version, checksum_dir)
-    cache_dir, archive_name = get_archive(version, cache_dirs)
-    verify_archive(version, cache_dir, archive_name, checksum_dir)
+    get_checksums(version, checksum_dir, verified)
+    cache_dir, archive_name = get_archive(version, cache_dirs, verified)
+    digest = verify_archive(version, cache_dir, archive_name, checksum_dir, verified)
 
-    executable_dir = os.environ.get('STEP_TEMP_DIR', f'/tmp/terraform_{version}')
+    if executable_dir is None:
+        executable_dir = os.environ.get('STEP_TEMP_DIR', f'/tmp/terraform_{version}')
 
-    Path(executable_dir, 'terraform').unlink(missing_ok=True)
-    with ZipFile(Path(cache_dir, archive_name)) as f:
-        f.extract('terraform', executable_dir)
+    stored_path, executable_digest = extract_executable(Path(cache_dir, archive_name), digest, Path(checksum_dir, 'executables'), verified)
 
     executable_path = Path(executable_dir, 'terraform')
+    copy_executable(stored_path, executable_path, executable_digest)
+
+    return executable_path
+
+
+def extract_executable(archive_path: Path, digest: str, store_dir: Path, verified: Optional[ActionsCache] = None) -> Tuple[Path, str]:
+    """
+    Get the terraform executable from a verified archive
+
+    Extracted executables are kept in store_dir by the digest of the archive they came from, so each archive is
+    only extracted once. The digest of each extracted executable is stored in the verified cache, and an executable in
+    the store is only used if it still has that digest. Without a verified cache the archive is always extracted.
+    The executable is extracted to a temporary file that is renamed into place, so concurrent callers never see a
+    partially extracted executable.
+
+    :returns: The path of the executable in the store, and its SHA-256 digest
+    """
+
+    stored_path = Path(store_dir, digest, 'terraform')
+    executable_key = f'executables/{digest}'
+
+    if verified is not None and executable_key in verified and stored_path.is_file():
+        executable_digest = verified[executable_key]
+        if file_digest(stored_path, verified) == executable_digest:
+            debug(f'Using extracted executable for {archive_path.name}')
+            return stored_path, executable_digest
 
-    os.chmod(executable_path, 755)
+        debug(f'Extracted executable for {archive_path.name} has been changed, extracting it again')
 
+    os.makedirs(stored_path.parent, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=stored_path.parent, prefix='.extract.')
+    try:
+        with ZipFile(archive_path) as f:
+            f.extract('terraform', tmp_dir)
+
+        tmp_path = Path(tmp_dir, 'terraform')
+        os.chmod(tmp_path, 0o755)
+        executable_digest = _hash_file(tmp_path)
+        os.replace(tmp_path, stored_path)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    if verified is not None:
+        _store_digest(stored_path, executable_digest, verified)
+        verified[executable_key] = executable_digest
+
+    return stored_path, executable_digest
+
+
+def copy_executable(stored_path: Path, executable_path: Path, digest: str) -> None:
+    """
+    Atomically put a copy of an executable from the store at executable_path
+
+    The executable is copied rather than linked, so writing to executable_path can't change the store.
+    The copy is hashed as it is written, and is only put in place if it has the expected digest.
+    """
+
+    os.makedirs(executable_path.parent, exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(dir=executable_path.parent, prefix=f'.{executable_path.name}.')
+    try:
+        h = hashlib.sha256()
+        with os.fdopen(fd, 'wb') as f, open(stored_path, 'rb') as source:
+            while chunk := source.read(_CHUNK_SIZE):
+                h.update(chunk)
+                f.write(chunk)
+
+        if h.hexdigest() != digest:
+            raise DownloadError(f'Could not verify integrity of {stored_path} while copying it')
+
+        os.chmod(tmp_path, 0o755)
+        os.replace(tmp_path, executable_path)
+    except BaseException:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
+
+
+def get_terragrunt_executable(version: Version, cache_dir: Path, checksum_dir: Path, verified: Optional[ActionsCache] = None) -> Path:
+    """
+    Get the path to the specified terragrunt executable
+
+    The executable is downloaded to cache_dir if it isn't already there, and the checksums for the release to
+    checksum_dir. The executable is always verified against the checksums.
+
+    terragrunt releases are not signed, so the checksums are only as trustworthy as the HTTPS download from GitHub,
+    and checksum_dir must only be written to by the action. The checksums are downloaded again if they don't
+    have a checksum for this platform.
+    """
+
+    release_url = f'https://github.com/gruntwork-io/terragrunt/releases/download/v{version}'
+    release_name = f'terragrunt_{get_platform()}_{get_arch()}'
+
+    checksums_path = Path(checksum_dir, f'terragrunt_{version}_SHA256SUMS')
+    checksum = _expected_checksum(checksums_path, release_name) if checksums_path.is_file() else None
+    if checksum is None:
+        _download(f'{release_url}/SHA256SUMS', checksums_path, f'checksums for terragrunt {version}')
+        checksum = _expected_checksum(checksums_path, release_name)
+
+    if checksum is None:
+        raise DownloadError(f'Checksum for {release_name} not found for terragrunt {version}')
+
+    executable_path = Path(cache_dir, f'terragrunt_{version}_{get_platform()}_{get_arch()}')
+    if not executable_path.is_file():
+        digest = _download(f'{release_url}/{release_name}', executable_path, f'terragrunt {version} for this platform ({get_platform()}_{get_arch()})')
+        _store_digest(executable_path, digest, verified)
+
+    if file_digest(executable_path, verified) != checksum:
+        executable_path.unlink()
+        raise DownloadError(f'Could not verify integrity of terragrunt executable for {version}')
+
+    os.chmod(executable_path, 0o755)
     return executable_path
+
+
+class Toolchain(NamedTuple):
+    """The paths of the installed executables"""
+    terragrunt: Path
+    terraform: Path
+
+
+def _install(source: Path, path: Path) -> None:
+    """Atomically replace path with a symlink to source"""
+
+    tmp_path = Path(path.parent, f'.{path.name}.{os.getpid()}')
+    tmp_path.unlink(missing_ok=True)
+    os.symlink(source, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _installed(cache_dir: Path, product: str, version: Version) -> Path:
+    return Path(cache_dir, 'installed', f'{product}_{version}_{get_platform()}_{get_arch()}', product)
+
+
+def _verified_install(installed_path: Path, verified: ActionsCache) -> bool:
+    """Is there an installed executable at installed_path that hasn't changed since it was installed"""
+
+    key = f'installed/{installed_path.parent.name}'
+    if not installed_path.is_file() or key not in verified:
+        return False
+
+    return file_digest(installed_path, verified) == verified[key]
+
+
+def install_toolchain(terragrunt_version: Version, terraform_version: Version, bin_dir: Path, cache_dir: Path) -> Toolchain:
+    """
+    Install terragrunt and terraform into bin_dir
+
+    Executables are kept in cache_dir by version once they have been verified, and installed from there on later calls
+    without any downloading. The digest of each executable is stored when it is cached, and it is only installed
+    from the cache while it still has that digest. Anything missing from the cache or changed is downloaded and
+    verified, with terragrunt and terraform fetched at the same time.
+
+    cache_dir must only be written to by the action, as what has already been verified is remembered there.
+    """
+
+    terragrunt_path = _installed(cache_dir, 'terragrunt', terragrunt_version)
+    terraform_path = _installed(cache_dir, 'terraform', terraform_version)
+    verified = ActionsCache(Path(cache_dir, 'verified'), 'verified toolchain files')
+
+    def terragrunt() -> Path:
+        if _verified_install(terragrunt_path, verified):
+            debug(f'Using cached terragrunt {terragrunt_version}')
+            return terragrunt_path
+
+        executable = get_terragrunt_executable(terragrunt_version, Path(cache_dir, 'terragrunt-bin-dir'), Path(cache_dir, 'checksums'), verified)
+        digest = file_digest(executable, verified)
+        copy_executable(executable, terragrunt_path, digest)
+        verified[f'installed/{terragrunt_path.parent.name}'] = digest
+        return terragrunt_path
+
+    def terraform() -> Path:
+        if _verified_install(terraform_path, verified):
+            debug(f'Using cached terraform {terraform_version}')
+            return terraform_path
+
+        cache_dirs = [Path(p) for p in os.environ['TERRAFORM_BIN_CACHE_DIR'].split(':')] if 'TERRAFORM_BIN_CACHE_DIR' in os.environ else [Path(cache_dir, 'terraform-bin-dir')]
+        checksum_dir = Path(os.environ.get('TERRAFORM_BIN_CHECKSUM_DIR', Path(cache_dir, 'checksums')))
+
+        executable = get_executable(terraform_version, cache_dirs, checksum_dir, terraform_path.parent, verified)
+        verified[f'installed/{terraform_path.parent.name}'] = file_digest(executable, verified)
+        return executable
+
+    os.makedirs(cache_dir, exist_ok=True)
+    os.makedirs(bin_dir, exist_ok=True)
+
+    if _verified_install(terragrunt_path, verified) and _verified_install(terraform_path, verified):
+        terragrunt_executable, terraform_executable = terragrunt(), terraform()
+    else:
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            terragrunt_future = executor.submit(terragrunt)
+            terraform_future = executor.submit(terraform)
+            terragrunt_executable, terraform_executable = terragrunt_future.result(), terraform_future.result()
+
+    _install(terragrunt_executable, Path(bin_dir, 'terragrunt'))
+    _install(terraform_executable, Path(bin_dir, 'terraform'))
+
+    return Toolchain(Path(bin_dir, 'terragrunt'), Path(bin_dir, 'terraform'))
+
+
+def install_toolchain_main() -> int:
+    """
+    Entrypoint for `install-toolchain`
+
+    Usage:
+        install-toolchain <TERRAGRUNT_VERSION> <TERRAFORM_VERSION>
+
+    The executables are installed into TOOLCHAIN_BIN_DIR, which defaults to /usr/local/bin.
+    Verified executables are cached in TOOLCHAIN_CACHE_DIR, which defaults to JOB_TMP_DIR/toolchain.
+    """
+
+    if len(sys.argv) != 3:
+        sys.stderr.write('Usage: install-toolchain <TERRAGRUNT_VERSION> <TERRAFORM_VERSION>\n')
+        return 1
+
+    try:
+        terragrunt_version = Version(sys.argv[1], product='Terragrunt')
+        terraform_version = Version(sys.argv[2])
+    except ValueError as e:
+        sys.stderr.write(f'{e}\n')
+        return 1
+
+    bin_dir = Path(os.environ.get('TOOLCHAIN_BIN_DIR', '/usr/local/bin'))
+    cache_dir = Path(os.environ.get('TOOLCHAIN_CACHE_DIR', Path(os.environ.get('JOB_TMP_DIR', '.'), 'toolchain')))
+
+    try:
+        toolchain = install_toolchain(terragrunt_version, terraform_version, bin_dir, cache_dir)
+    except DownloadError as e:
+        sys.stderr.write(f'{e}\n')
+        return 1
+
+    sys.stdout.write(f'Installed terragrunt {terragrunt_version} to {toolchain.terragrunt}\n')
+    sys.stdout.write(f'Installed terraform {terraform_version} to {toolchain.terraform}\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(install_toolchain_main())
@@ -2,9 +2,23 @@
 
 from __future__ import annotations
 
+import io
+import json
 import os
+import subprocess
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import NamedTuple, Optional
 
+from github_actions.debug import debug
 from github_actions.inputs import InitInputs
+from plan_renderer.summary import PlanSummary
+from terraform.plan_hash import plan_lines_hash
+
+# The name of the plan summary written to PLAN_OUT_DIR alongside the plan files
+PLAN_SUMMARY_NAME = 'index.json'
 
 
 def init_args(inputs: InitInputs) -> list[str]:
@@ -23,3 +37,231 @@ def init_args(inputs: InitInputs) -> list[str]:
             args.append(f'-backend-config={stripped}')
 
     return args
+
+
+def plan_name(module_path: str) -> str:
+    """
+    The name of the plan file for a module
+
+    This is the module path with each '/' replaced by '___', the same as the action scripts.
+    """
+
+    return module_path.replace('/', '___')
+
+
+def write_atomic(path: Path, content: str) -> None:
+    """
+    Write a file so that readers only ever see the complete content
+
+    The content is written to a temporary file in the same directory, which is then renamed over the destination.
+    """
+
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f'.{path.name}.')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
+
+
+class ShowResult(NamedTuple):
+    """The result of running `terragrunt show` for a module."""
+    module_path: str
+    returncode: int
+    stdout: str
+    stderr: str
+
+
+def show_json(args: list[str], path: Path) -> int:
+    """
+    Run a `terragrunt show -json` command, streaming stdout into a file
+
+    JSON plans can be very large, so they are never held in memory.
+    The file is only moved into place if the command succeeds.
+    """
+
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f'.{path.name}.')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            process = subprocess.run(args, stdout=f, stderr=subprocess.DEVNULL)
+
+        if process.returncode == 0:
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        else:
+            Path(tmp_path).unlink()
+
+        return process.returncode
+    except BaseException:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
+
+
+def show(module_path: str, plan_out_dir: Path, stderr_dir: Path, download_dir: str, json_dir: Optional[Path] = None) -> ShowResult:
+    """
+    Run `terragrunt show` for the saved plan of a module
+
+    The plan text is written to a file in plan_out_dir, and stderr to a file in stderr_dir.
+    If json_dir is set, the JSON plan is also written to a file in json_dir.
+    All files are named after the module.
+    """
+
+    args = ['terragrunt', 'show', 'plan.out', '--terragrunt-working-dir', module_path, '-no-color']
+    if download_dir:
+        args += ['--terragrunt-download-dir', download_dir]
+
+    debug(' '.join(args))
+    process = subprocess.run(args, capture_output=True, text=True)
+
+    name = plan_name(module_path)
+    write_atomic(Path(plan_out_dir, name), process.stdout)
+    write_atomic(Path(stderr_dir, f'{name}.stderr'), process.stderr)
+
+    returncode = process.returncode
+
+    if json_dir is not None:
+        debug(' '.join(args + ['-json']))
+        returncode = returncode or show_json(args + ['-json'], Path(json_dir, f'{name}.json'))
+
+    return ShowResult(module_path, returncode, process.stdout, process.stderr)
+
+
+def show_all(module_paths: list[str], plan_out_dir: Path, stderr_dir: Path, download_dir: str, workers: int, json_dir: Optional[Path] = None) -> list[ShowResult]:
+    """
+    Run `terragrunt show` for the saved plan of every module
+
+    At most `workers` show commands are run at the same time.
+    The results are returned in the same order as module_paths.
+    """
+
+    os.makedirs(plan_out_dir, exist_ok=True)
+    os.makedirs(stderr_dir, exist_ok=True)
+    if json_dir is not None:
+        os.makedirs(json_dir, exist_ok=True)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        return list(executor.map(lambda module_path: show(module_path, plan_out_dir, stderr_dir, download_dir, json_dir), module_paths))
+
+
+def plan_summary(result: ShowResult) -> dict:
+    """
+    The machine readable summary of the plan for a module
+
+    The plan hash is of the normalized plan text without a salt, so it can be compared between steps and jobs.
+    """
+
+    summary = PlanSummary(result.module_path)
+    lines = summary.lines(io.StringIO(result.stdout))
+    plan_hash = plan_lines_hash(lines, '', strip=True)
+
+    # Hashing stops at any warnings after the plan, but the summary needs every line
+    for _ in lines:
+        pass
+
+    counts = {'add': 0, 'change': 0, 'destroy': 0, **summary.counts}
+
+    return {
+        'module_path': result.module_path,
+        'plan_name': plan_name(result.module_path),
+        'add': counts['add'],
+        'change': counts['change'],
+        'destroy': counts['destroy'],
+        'move': counts['move'],
+        'error': result.returncode != 0 or counts['error'],
+        'changes': not summary.no_changes,
+        'plan_hash': plan_hash
+    }
+
+
+def write_plan_summary(results: list[ShowResult], plan_out_dir: Path) -> Path:
+    """
+    Write the summary of every module's plan to index.json in plan_out_dir
+
+    Returns the path of the summary.
+    """
+
+    path = Path(plan_out_dir, PLAN_SUMMARY_NAME)
+    write_atomic(path, json.dumps({'modules': [plan_summary(result) for result in results]}, indent=2) + '\n')
+    return path
+
+
+def read_plan_summary(plan_out_dir: Path) -> dict[str, dict]:
+    """
+    Read the plan summary written by terragrunt-show-all
+
+    Returns the summary of each module by module path, which is empty if there is no summary.
+    """
+
+    try:
+        with open(Path(plan_out_dir, PLAN_SUMMARY_NAME)) as f:
+            return {module['module_path']: module for module in json.load(f)['modules']}
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        debug(f'Unable to read plan summary: {e}')
+        return {}
+
+
+def parallelism() -> int:
+    """
+    The number of modules to run commands for at the same time, from the parallelism input
+
+    If the input is not set or is 0, this is the number of CPUs.
+    """
+
+    try:
+        workers = int(os.environ.get('INPUT_PARALLELISM', '0'))
+    except ValueError:
+        workers = 0
+
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+
+    return workers
+
+
+def show_all_main() -> int:
+    """
+    Entrypoint for `terragrunt-show-all`
+
+    Usage:
+        terragrunt-show-all <MODULE_PATH>...
+
+    The plan text for each module is written to PLAN_OUT_DIR and printed to stdout.
+    stderr for each module is written to STEP_TMP_DIR/terraform_show_plan/, and all of it collected
+    into STEP_TMP_DIR/terraform_show_plan.stderr.
+    If the plan_hash input is 'json', the JSON plan for each module is written to STEP_TMP_DIR/plan_json/.
+    A summary of the plan for every module is written to PLAN_OUT_DIR/index.json.
+    """
+
+    module_paths = sys.argv[1:]
+
+    step_tmp_dir = Path(os.environ.get('STEP_TMP_DIR', '.'))
+    plan_out_dir = Path(os.environ.get('PLAN_OUT_DIR', step_tmp_dir / 'plan'))
+
+    workers = parallelism()
+    debug(f'Running terragrunt show for {len(module_paths)} modules with {workers} workers')
+
+    json_dir = step_tmp_dir / 'plan_json' if os.environ.get('INPUT_PLAN_HASH') == 'json' else None
+
+    results = show_all(module_paths, plan_out_dir, step_tmp_dir / 'terraform_show_plan', os.environ.get('TG_CACHE_DIR', ''), workers, json_dir)
+
+    with open(step_tmp_dir / 'terraform_show_plan.stderr', 'w') as f:
+        for result in results:
+            if result.stderr:
+                f.write(f'[{result.module_path}]\n')
+                f.write(result.stderr)
+                if not result.stderr.endswith('\n'):
+                    f.write('\n')
+
+    for result in results:
+        sys.stdout.write(result.stdout)
+
+    write_plan_summary(results, plan_out_dir)
+
+    return 0 if all(result.returncode == 0 for result in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(show_all_main())
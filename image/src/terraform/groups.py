@@ -0,0 +1,412 @@
+"""
+Running terragrunt commands for each module in dependency order
+
+Modules are run as soon as all the modules they depend on have finished, with at most a fixed number running at once.
+The dependencies come from `terragrunt graph-dependencies` if it is available. Otherwise each module depends on every
+module in the previous group from `terragrunt output-module-groups`, so a whole group is run before the next.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Callable, Container, Iterable, Iterator, NamedTuple, Optional
+
+from github_actions.debug import debug
+from terraform.exec import parallelism, plan_name, read_plan_summary, write_atomic
+
+_edge = re.compile(r'"([^"]+)"\s*->\s*"([^"]+)"')
+_node = re.compile(r'"([^"]+)"')
+
+
+class ModuleResult(NamedTuple):
+    """
+    The result of running a command for a module
+
+    status is one of:
+     - succeeded: the command exited with status 0
+     - failed: the command exited with a non-zero status
+     - skipped: the command didn't need to be run
+     - blocked: the command wasn't run because a module it depends on failed or was blocked
+    """
+    module_path: str
+    status: str
+    returncode: Optional[int] = None
+    stdout: str = ''
+    stderr: str = ''
+    seconds: float = 0
+
+    @property
+    def ok(self) -> bool:
+        return self.status in ('succeeded', 'skipped')
+
+
+def module_groups(working_dir: str, groups_path: Optional[Path] = None) -> list[list[str]]:
+    """
+    The groups of modules in working_dir, in the order they should be run
+
+    If groups_path is a file containing the output of `terragrunt output-module-groups` it is used instead of
+    running terragrunt again.
+    """
+
+    if groups_path is not None and groups_path.is_file():
+        debug(f'Reading module groups from {groups_path}')
+        output = groups_path.read_text()
+    else:
+        args = ['terragrunt', 'output-module-groups', '--terragrunt-working-dir', working_dir]
+        debug(' '.join(args))
+        output = subprocess.run(args, capture_output=True, text=True, check=True).stdout
+
+    return [list(modules) for modules in json.loads(output).values()]
+
+
+def _module_path(base: str, module: str) -> str:
+    return os.path.normpath(os.path.join(base, module))
+
+
+def dependency_graph(working_dir: str) -> Optional[dict[str, set[str]]]:
+    """
+    The modules each module in working_dir depends on, from `terragrunt graph-dependencies`
+
+    terragrunt writes the module paths relative to working_dir. They are returned as absolute paths, and every module in
+    the graph is included, even if it has no dependencies.
+    Returns None if the graph can't be generated.
+    """
+
+    args = ['terragrunt', 'graph-dependencies', '--terragrunt-working-dir', working_dir]
+    debug(' '.join(args))
+
+    try:
+        process = subprocess.run(args, capture_output=True, text=True)
+    except OSError as e:
+        debug(f'Unable to get the dependency graph: {e}')
+        return None
+
+    if process.returncode != 0:
+        debug(f'Unable to get the dependency graph: {process.stderr}')
+        return None
+
+    base = os.path.abspath(working_dir)
+
+    graph: dict[str, set[str]] = {_module_path(base, module): set() for module in _node.findall(process.stdout)}
+    for module, dependency in _edge.findall(process.stdout):
+        graph[_module_path(base, module)].add(_module_path(base, dependency))
+
+    return graph
+
+
+def group_dependencies(groups: list[list[str]]) -> dict[str, set[str]]:
+    """Make each module depend on every module in the previous group"""
+
+    dependencies = {}
+    previous: set[str] = set()
+
+    for group in groups:
+        for module in group:
+            dependencies[module] = previous
+        previous = set(group)
+
+    return dependencies
+
+
+def module_dependencies(working_dir: str, groups: list[list[str]]) -> dict[str, set[str]]:
+    """
+    The modules each module depends on
+
+    This is the dependency graph if terragrunt can generate it, or the group order if it can't or any of the modules
+    are missing from it. Dependencies on modules that aren't in the groups are ignored.
+    """
+
+    base = os.path.abspath(working_dir)
+    modules = {_module_path(base, module): module for group in groups for module in group}
+
+    graph = dependency_graph(working_dir)
+    if graph is None:
+        debug('Using module groups as dependencies')
+        return group_dependencies(groups)
+
+    if missing := [module for path, module in modules.items() if path not in graph]:
+        debug(f'Using module groups as dependencies, {", ".join(missing)} not in the dependency graph')
+        return group_dependencies(groups)
+
+    return {
+        module: {modules[dependency] for dependency in graph.get(path, ()) if dependency in modules}
+        for path, module in modules.items()
+    }
+
+
+def run_modules(modules: Iterable[str],
+                dependencies: dict[str, set[str]],
+                run: Callable[[str], subprocess.CompletedProcess],
+                workers: int,
+                skip: Callable[[str], bool] = lambda module_path: False,
+                success_codes: Container[int] = (0,)) -> Iterator[ModuleResult]:
+    """
+    Run a command for each module, after the modules it depends on
+
+    :param modules: The modules to run, in the order they should be started when there is a choice
+    :param dependencies: The modules each module depends on
+    :param run: Runs the command for a module
+    :param workers: The maximum number of commands to run at the same time
+    :param skip: Modules this returns True for are not run, but count as succeeded
+    :param success_codes: The exit statuses of a command that succeeded
+
+    Yields the result of each module as it finishes.
+    Modules that depend on a module that failed are not run.
+    """
+
+    modules = list(modules)
+
+    waiting_on = {module: set(dependencies.get(module, ())) & set(modules) for module in modules}
+    dependents: dict[str, list[str]] = {module: [] for module in modules}
+    for module, module_dependencies in waiting_on.items():
+        for dependency in module_dependencies:
+            dependents[dependency].append(module)
+
+    blocked: set[str] = set()
+    ready = deque(module for module in modules if not waiting_on[module])
+    running: dict[Future, str] = {}
+
+    def finished(result: ModuleResult) -> ModuleResult:
+        for dependent in dependents[result.module_path]:
+            waiting_on[dependent].discard(result.module_path)
+            if not result.ok:
+                blocked.add(dependent)
+            if not waiting_on[dependent]:
+                ready.append(dependent)
+        del waiting_on[result.module_path]
+        return result
+
+    def timed_run(module: str) -> tuple[subprocess.CompletedProcess, float]:
+        started = time.monotonic()
+        process = run(module)
+        return process, time.monotonic() - started
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        while ready or running:
+            while ready:
+                module = ready.popleft()
+
+                if module in blocked:
+                    yield finished(ModuleResult(module, 'blocked'))
+                elif skip(module):
+                    yield finished(ModuleResult(module, 'skipped'))
+                else:
+                    running[executor.submit(timed_run, module)] = module
+
+            if not running:
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                module = running.pop(future)
+                process, seconds = future.result()
+                yield finished(ModuleResult(
+                    module_path=module,
+                    status='succeeded' if process.returncode in success_codes else 'failed',
+                    returncode=process.returncode,
+                    stdout=process.stdout,
+                    stderr=process.stderr,
+                    seconds=seconds
+                ))
+
+    # Anything left is part of a dependency cycle
+    for module in modules:
+        if module in waiting_on:
+            debug(f'{module} is in a dependency cycle')
+            yield ModuleResult(module, 'blocked')
+
+
+def mask(text: str) -> str:
+    """Mask sensitive values in terraform output using the TFMASK command, if there is one"""
+
+    tfmask = os.environ.get('TFMASK', 'cat')
+    if not text or tfmask == 'cat':
+        return text
+
+    return subprocess.run([tfmask], input=text, capture_output=True, text=True).stdout
+
+
+def apply(module_path: str, download_dir: str, args: list[str]) -> subprocess.CompletedProcess:
+    """Apply the saved plan for a module"""
+
+    command = ['terragrunt', 'apply', '--terragrunt-working-dir', module_path]
+    if download_dir:
+        command += ['--terragrunt-download-dir', download_dir]
+    command += ['-input=false', '-no-color', '-auto-approve', '-lock-timeout=300s', *args, 'plan.out']
+
+    debug(' '.join(command))
+    return subprocess.run(command, capture_output=True, text=True)
+
+
+def plan(module_path: str, download_dir: str, args: list[str]) -> subprocess.CompletedProcess:
+    """Create a saved plan for a module"""
+
+    command = ['terragrunt', 'plan', '--terragrunt-working-dir', module_path]
+    if download_dir:
+        command += ['--terragrunt-download-dir', download_dir]
+    command += ['-input=false', '-no-color', '-detailed-exitcode', '-lock-timeout=300s', '-out=plan.out', *args]
+
+    debug(' '.join(command))
+    return subprocess.run(command, capture_output=True, text=True)
+
+
+def _scheduled_modules(working_dir: str, step_tmp_dir: Path) -> tuple[list[str], dict[str, set[str]]]:
+    """The modules in working_dir in group order, and the modules each depends on"""
+
+    groups = module_groups(working_dir, step_tmp_dir / 'module_groups.json')
+    debug(f'Found {sum(len(group) for group in groups)} modules in {len(groups)} groups')
+
+    return [module for group in groups for module in group], module_dependencies(working_dir, groups)
+
+
+def plan_groups_main() -> int:
+    """
+    Entrypoint for `terragrunt-plan-groups`
+
+    Usage:
+        terragrunt-plan-groups [PLAN_ARG]...
+
+    Plans each module in INPUT_PATH in dependency order, with up to the parallelism input number of modules at once.
+    The module groups are read from STEP_TMP_DIR/module_groups.json if it exists.
+
+    The stdout and stderr of each module are written to STEP_TMP_DIR/terraform_plan_stdout/ and
+    STEP_TMP_DIR/terraform_plan_error/, and all the stderr is collected into STEP_TMP_DIR/terraform_plan.stderr.
+    The plan for each module is printed as soon as it finishes, with the time it took and the time since the start.
+    The timings of every module are written to STEP_TMP_DIR/terraform_plan_metrics.json.
+    """
+
+    step_tmp_dir = Path(os.environ.get('STEP_TMP_DIR', '.'))
+    working_dir = os.environ.get('INPUT_PATH', '.')
+    download_dir = os.environ.get('TG_CACHE_DIR', '')
+    args = sys.argv[1:]
+
+    stdout_dir = step_tmp_dir / 'terraform_plan_stdout'
+    stderr_dir = step_tmp_dir / 'terraform_plan_error'
+    os.makedirs(stdout_dir, exist_ok=True)
+    os.makedirs(stderr_dir, exist_ok=True)
+
+    start = time.monotonic()
+    modules, dependencies = _scheduled_modules(working_dir, step_tmp_dir)
+    workers = parallelism()
+
+    debug(f'Planning {len(modules)} modules with {workers} workers')
+
+    results = []
+    metrics = []
+
+    # -detailed-exitcode exits with 2 when there are changes
+    for result in run_modules(modules, dependencies, lambda module_path: plan(module_path, download_dir, args), workers, success_codes=(0, 2)):
+        elapsed = time.monotonic() - start
+        results.append(result)
+        metrics.append({'module_path': result.module_path, 'status': result.status, 'returncode': result.returncode, 'seconds': round(result.seconds, 3), 'finished': round(elapsed, 3)})
+
+        if result.status == 'blocked':
+            sys.stdout.write(f'[{elapsed:.1f}s] Not planning {result.module_path} because a module it depends on failed\n')
+        else:
+            name = plan_name(result.module_path)
+            stdout = mask(result.stdout)
+            write_atomic(stdout_dir / f'{name}.stdout', stdout)
+            write_atomic(stderr_dir / f'{name}.stderr', result.stderr)
+
+            if result.ok:
+                changes = 'changes' if result.returncode == 2 else 'no changes'
+                sys.stdout.write(f'[{elapsed:.1f}s] Planned {result.module_path} in {result.seconds:.1f}s ({changes})\n')
+            else:
+                sys.stdout.write(f'[{elapsed:.1f}s] Failed to plan {result.module_path} after {result.seconds:.1f}s (exit status {result.returncode})\n')
+
+            sys.stdout.write(stdout)
+
+        sys.stdout.flush()
+
+    total = time.monotonic() - start
+
+    with open(step_tmp_dir / 'terraform_plan.stderr', 'w') as f:
+        for result in results:
+            if result.stderr:
+                f.write(f'[{result.module_path}]\n')
+                f.write(result.stderr)
+                if not result.stderr.endswith('\n'):
+                    f.write('\n')
+
+    write_atomic(step_tmp_dir / 'terraform_plan_metrics.json', json.dumps({
+        'workers': workers,
+        'first_result': metrics[0]['finished'] if metrics else None,
+        'total': round(total, 3),
+        'modules': metrics
+    }, indent=2) + '\n')
+
+    if metrics:
+        slowest = max(metrics, key=lambda module: module['seconds'])
+        sys.stdout.write(f'Planned {len(metrics)} modules in {total:.1f}s, first result after {metrics[0]["finished"]:.1f}s, slowest module {slowest["module_path"]} took {slowest["seconds"]:.1f}s\n')
+
+    return 0 if all(result.ok for result in results) else 1
+
+
+def apply_groups_main() -> int:
+    """
+    Entrypoint for `terragrunt-apply-groups`
+
+    Usage:
+        terragrunt-apply-groups [APPLY_ARG]...
+
+    Applies the saved plan of each module in INPUT_PATH in dependency order, with up to the parallelism input
+    number of modules at once. Modules the plan summary in PLAN_OUT_DIR shows have no changes are skipped.
+    The module groups are read from STEP_TMP_DIR/module_groups.json if it exists.
+
+    The stdout and stderr of each applied module are written to STEP_TMP_DIR/terraform_apply_stdout/ and
+    STEP_TMP_DIR/terraform_apply_error/, and the result of each module is printed as it finishes.
+    """
+
+    step_tmp_dir = Path(os.environ.get('STEP_TMP_DIR', '.'))
+    plan_out_dir = Path(os.environ.get('PLAN_OUT_DIR', step_tmp_dir / 'plan'))
+    working_dir = os.environ.get('INPUT_PATH', '.')
+    download_dir = os.environ.get('TG_CACHE_DIR', '')
+    args = sys.argv[1:]
+
+    stdout_dir = step_tmp_dir / 'terraform_apply_stdout'
+    stderr_dir = step_tmp_dir / 'terraform_apply_error'
+    os.makedirs(stdout_dir, exist_ok=True)
+    os.makedirs(stderr_dir, exist_ok=True)
+
+    modules, dependencies = _scheduled_modules(working_dir, step_tmp_dir)
+    summary = read_plan_summary(plan_out_dir)
+    workers = parallelism()
+
+    def no_changes(module_path: str) -> bool:
+        return summary.get(module_path, {}).get('changes') is False
+
+    debug(f'Applying {len(modules)} modules with {workers} workers')
+
+    failed = False
+    for result in run_modules(modules, dependencies, lambda module_path: apply(module_path, download_dir, args), workers, no_changes):
+        if result.status == 'skipped':
+            sys.stdout.write(f'There are no changes in the module {result.module_path}, skipping apply for it\n')
+        elif result.status == 'blocked':
+            failed = True
+            sys.stdout.write(f'Not applying {result.module_path} because a module it depends on was not applied\n')
+        else:
+            name = plan_name(result.module_path)
+            write_atomic(stdout_dir / f'{name}.stdout', mask(result.stdout))
+            write_atomic(stderr_dir / f'{name}.stderr', result.stderr)
+
+            if result.ok:
+                sys.stdout.write(f'Applied {result.module_path} in {result.seconds:.1f}s\n')
+            else:
+                failed = True
+                sys.stdout.write(f'Failed to apply {result.module_path} after {result.seconds:.1f}s (exit status {result.returncode})\n')
+
+        sys.stdout.flush()
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(apply_groups_main())
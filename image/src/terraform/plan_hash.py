@@ -0,0 +1,113 @@
+"""
+Normalizing and hashing terraform plan text
+
+The plan text is normalized by removing unchanged attribute comments and any warnings after the plan summary.
+This is done a line at a time, so plans of any size can be hashed in bounded memory.
+"""
+
+import hashlib
+import re
+from typing import Iterable, Iterator
+
+from github_actions.debug import debug
+
+_unchanged_attributes = re.compile(r'\s+# \(\d+ unchanged attributes hidden\)')
+_plan_summary = re.compile(r'Plan: \d+ to add, \d+ to change, \d+ to destroy')
+
+
+def _split_lines(lines: Iterable[str]) -> Iterator[str]:
+    """
+    Split lines read from a file the same way str.splitlines() splits the whole text
+
+    A line read from a file only ends at '\n', but may contain other characters that splitlines() treats as line boundaries.
+    """
+
+    for line in lines:
+        yield from line.splitlines()
+
+
+def _strip_lines(lines: Iterable[str]) -> Iterator[str]:
+    """
+    The lines of '\n'.join(lines).strip(), without joining them
+
+    Blank lines at the start and end are dropped, and the first and last remaining lines are stripped.
+    Only the trailing blank lines that haven't yet been followed by a non-blank line are held in memory.
+    """
+
+    first = True
+    pending = None
+    blank = []
+
+    for line in lines:
+        if not line.strip():
+            if not first:
+                blank.append(line)
+            continue
+
+        if first:
+            line = line.lstrip()
+            first = False
+
+        if pending is not None:
+            yield pending
+            yield from blank
+            blank.clear()
+
+        pending = line
+
+    if pending is not None:
+        yield pending.rstrip()
+
+
+def _without_unchanged_attributes(lines: Iterable[str]) -> Iterator[str]:
+    return (line for line in lines if not _unchanged_attributes.match(line))
+
+
+def _without_warnings(lines: Iterable[str]) -> Iterator[str]:
+    plan_summary_reached = False
+
+    for line in lines:
+        if plan_summary_reached and (line.startswith('Warning') or line.startswith('╷')):
+            return
+
+        yield line
+
+        if _plan_summary.match(line):
+            plan_summary_reached = True
+
+
+def normalized_plan_lines(lines: Iterable[str], strip: bool = False) -> Iterator[str]:
+    """
+    Normalize plan text a line at a time
+
+    lines are the lines of the plan text as read from a file, including line endings.
+    The result is the same as remove_warnings(remove_unchanged_attributes(plan_text)).splitlines(), where plan_text
+    is the joined lines, stripped first if strip is True. Only one line of the plan needs to be in memory at a time.
+    """
+
+    lines = _split_lines(lines)
+    if strip:
+        lines = _strip_lines(lines)
+
+    lines = _strip_lines(_without_unchanged_attributes(lines))
+    return _strip_lines(_without_warnings(lines))
+
+
+def plan_lines_hash(lines: Iterable[str], salt: str, strip: bool = False) -> str:
+    """
+    Compute a hash of the plan from the lines of the plan text
+
+    The plan is normalized and hashed a line at a time, so memory use doesn't depend on the size of the plan.
+    If strip is True the hash is the same as for the stripped plan text.
+    """
+
+    debug(f'Hashing with salt {salt}')
+
+    h = hashlib.sha256(f'dflook/terraform-github-actions/{salt}'.encode())
+
+    for i, line in enumerate(normalized_plan_lines(lines, strip)):
+        if i:
+            h.update(b'\n')
+        h.update(line.encode())
+
+    return h.hexdigest()
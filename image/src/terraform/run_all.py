@@ -0,0 +1,190 @@
+"""
+Parsing the stderr of `terragrunt run-all` commands
+
+terragrunt logs lines like:
+    time=2023-10-10T12:00:00Z level=error msg="Module /github/workspace/prod/vpc has finished with an error" prefix=[/github/workspace/prod/vpc]
+
+and ends with a summary of the modules that failed:
+    time=2023-10-10T12:00:01Z level=error msg=2 errors occurred:
+        * [/github/workspace/prod/vpc] exit status 1
+        * Cannot process module Module /github/workspace/prod/app ... because one of its dependencies, ..., finished with an error
+
+The stderr is read once, a line at a time, so even very large logs are parsed in bounded memory.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import re
+import sys
+from collections import deque
+from datetime import datetime
+from typing import Iterable, NamedTuple, Optional
+
+_exit_status = re.compile(r'^\s*\* \[(?P<module>[^\]]+)\] exit status (?P<code>\d+)')
+_cannot_process = re.compile(r'^\s*\* Cannot process module Module (?P<module>\S+)')
+_time = re.compile(r'(?:^|\s)time=(?P<time>\S+)')
+_level = re.compile(r'(?:^|\s)level=(?P<level>\S+)')
+_msg = re.compile(r'(?:^|\s)msg=(?P<msg>"(?:[^"\\]|\\.)*"|\S+)')
+_prefix = re.compile(r'(?:^|\s)prefix=\[(?P<module>[^\]]+)\]')
+_leading_prefix = re.compile(r'^\[(?P<module>[^\]]+)\]')
+
+# The number of error lines kept for each module
+EXCERPT_LINES = 20
+
+
+class ModuleStatus(NamedTuple):
+    """
+    The result of a module in a run-all command
+
+    status is one of:
+     - failed: the command for the module exited with status 1
+     - exited: the command for the module exited with another non-zero status, e.g. 2 when there are changes with -detailed-exitcode
+     - blocked: the module was not processed because one of its dependencies failed
+     - ok: the module was not reported as failing
+    """
+    module_path: str
+    status: str
+    exit_code: Optional[int]
+    duration: Optional[float]
+    excerpt: list[str]
+
+
+class _Module:
+    def __init__(self):
+        self.exit_code: Optional[int] = None
+        self.blocked = False
+        self.first: Optional[datetime] = None
+        self.last: Optional[datetime] = None
+        self.excerpt: deque[str] = deque(maxlen=EXCERPT_LINES)
+
+
+    def status(self, module_path: str) -> ModuleStatus:
+        if self.exit_code == 1:
+            status = 'failed'
+        elif self.exit_code:
+            status = 'exited'
+        elif self.blocked:
+            status = 'blocked'
+        else:
+            status = 'ok'
+
+        duration = (self.last - self.first).total_seconds() if self.first and self.last else None
+
+        return ModuleStatus(module_path, status, self.exit_code, duration, list(self.excerpt))
+
+
+def _timestamp(value: str) -> Optional[datetime]:
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+def _message(value: str) -> str:
+    if value.startswith('"'):
+        try:
+            return json.loads(value)
+        except ValueError:
+            return value.strip('"')
+    return value
+
+
+def parse_run_all(stderr: Iterable[str], modules: Optional[dict[str, _Module]] = None) -> dict[str, ModuleStatus]:
+    """
+    Parse the stderr of a run-all command
+
+    Returns the status of each module mentioned in the stderr, by module path.
+    The duration of a module is the time between the first and last log lines with its prefix.
+    The excerpt is the last error messages logged for the module.
+    """
+
+    modules = {} if modules is None else modules
+
+    def module(module_path: str) -> _Module:
+        if module_path not in modules:
+            modules[module_path] = _Module()
+        return modules[module_path]
+
+    for line in stderr:
+        if match := _exit_status.match(line):
+            module(match['module']).exit_code = int(match['code'])
+            continue
+
+        if match := _cannot_process.match(line):
+            module(match['module']).blocked = True
+            continue
+
+        if match := _prefix.search(line):
+            module_path = match['module']
+        elif match := _leading_prefix.match(line):
+            module_path = match['module']
+        else:
+            continue
+
+        state = module(module_path)
+
+        if (match := _time.search(line)) and (timestamp := _timestamp(match['time'])):
+            if state.first is None:
+                state.first = timestamp
+            state.last = timestamp
+
+        if (match := _level.search(line)) and match['level'] in ('error', 'fatal'):
+            message = _message(m['msg']) if (m := _msg.search(line)) else line.rstrip('\n')
+            state.excerpt.append(message)
+
+    return {module_path: state.status(module_path) for module_path, state in modules.items()}
+
+
+def parse_run_all_files(paths: Iterable[str]) -> dict[str, ModuleStatus]:
+    """Parse the stderr of run-all commands in many files, as if they were one"""
+
+    modules: dict[str, _Module] = {}
+    statuses = {}
+
+    for path in paths:
+        with open(path, errors='replace') as f:
+            statuses = parse_run_all(f, modules)
+
+    return statuses
+
+
+def stderr_paths(paths: Iterable[str]) -> list[str]:
+    """The files in paths, with each directory replaced by the files in it"""
+
+    files = []
+
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(
+                os.path.join(path, name) for name in os.listdir(path)
+                if os.path.isfile(os.path.join(path, name))
+            )
+        else:
+            files.append(path)
+
+    return files
+
+
+def main() -> int:
+    """
+    Entrypoint for `terragrunt-run-all-status`
+
+    Usage:
+        terragrunt-run-all-status <STDERR_PATH|DIRECTORY>...
+
+    Writes the status of each module as json to stdout, and exits with 1 if any module failed.
+    """
+
+    statuses = parse_run_all_files(stderr_paths(sys.argv[1:]))
+
+    sys.stdout.write(json.dumps({
+        module_path: status._asdict() for module_path, status in statuses.items()
+    }) + '\n')
+
+    return 1 if any(status.status == 'failed' for status in statuses.values()) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
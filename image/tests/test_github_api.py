@@ -0,0 +1,53 @@
+from unittest import mock
+
+import pytest
+import requests
+from urllib3.exceptions import MaxRetryError, NewConnectionError
+
+from github_actions.api import GithubApi, RetryPolicy
+
+
+def api_with_responses(*responses) -> tuple[GithubApi, mock.Mock]:
+    api = GithubApi('https://api.github.com', 'token', retry_policy=RetryPolicy(max_retries=5, backoff=0))
+    request = mock.Mock(side_effect=responses)
+    api._session.request = request
+    return api, request
+
+
+def response(status_code: int) -> requests.Response:
+    r = requests.Response()
+    r.status_code = status_code
+    r.request = requests.Request('POST', 'https://api.github.com/repos/a/b/issues/1/comments').prepare()
+    return r
+
+
+def test_post_not_retried_after_read_timeout():
+    api, request = api_with_responses(requests.ReadTimeout('read timed out'))
+
+    with pytest.raises(requests.ConnectionError) as e:
+        api.post('https://api.github.com/repos/a/b/issues/1/comments', json={'body': 'hello'})
+
+    assert request.call_count == 1
+    assert isinstance(e.value.__cause__, requests.ReadTimeout)
+
+
+def test_post_retried_after_connect_timeout():
+    api, request = api_with_responses(requests.ConnectTimeout('connect timed out'), response(201))
+
+    assert api.post('https://api.github.com/repos/a/b/issues/1/comments', json={'body': 'hello'}).status_code == 201
+    assert request.call_count == 2
+
+
+def test_post_retried_after_connection_refused():
+    refused = requests.ConnectionError(MaxRetryError(None, '/', NewConnectionError(None, 'Connection refused')))
+    api, request = api_with_responses(refused, response(201))
+
+    assert api.post('https://api.github.com/repos/a/b/issues/1/comments', json={'body': 'hello'}).status_code == 201
+    assert request.call_count == 2
+
+
+def test_get_retried_after_read_timeout():
+    api, request = api_with_responses(requests.ReadTimeout('read timed out'), response(200))
+
+    assert api.get('https://api.github.com/repos/a/b/issues/1/comments').status_code == 200
+    assert request.call_count == 2